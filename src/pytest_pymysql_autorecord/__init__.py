@@ -1,6 +1,22 @@
+from .tracing import (
+    ChromeTraceListener,
+    OpenTelemetryTraceListener,
+    TraceEvent,
+    add_trace_listener,
+    remove_trace_listener,
+)
 from .util import DatabaseMock, Mode, skip_for_db_mocking
 
 __version__ = "0.1.0"
 
 
-__all__ = ["DatabaseMock", "Mode", "skip_for_db_mocking"]
+__all__ = [
+    "ChromeTraceListener",
+    "DatabaseMock",
+    "Mode",
+    "OpenTelemetryTraceListener",
+    "TraceEvent",
+    "add_trace_listener",
+    "remove_trace_listener",
+    "skip_for_db_mocking",
+]
@@ -0,0 +1,123 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional, Tuple
+
+# Key of the checksums in pytest's cache, and the maximum number of checksums kept.
+_CHECKSUMS_KEY = "pytest_pymysql_autorecord/checksums"
+_MAX_CHECKSUMS = 10000
+
+
+class _ChecksumCache:
+    """
+    Cache of the checksums of data files.
+
+    Checksums are keyed by the path of a data file, and they are only used as long
+    as the file's modification time and size are unchanged. The checksums can be
+    saved to and loaded from pytest's cache, so that later test runs and other
+    processes (such as pytest-xdist workers) need not compute the checksums of
+    unchanged data files again.
+
+    Parameters
+    ----------
+    enabled: bool
+        Whether the cache is used.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._checksums: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+        self._new_checksums: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+
+    @staticmethod
+    def _key(filepath: Path) -> Tuple[str, int, int]:
+        stat = filepath.stat()
+        return str(filepath.resolve()), stat.st_mtime_ns, stat.st_size
+
+    def checksum(self, filepath: Path) -> Optional[str]:
+        """
+        Return the checksum of a data file, if it is known.
+
+        Parameters
+        ----------
+        filepath: `~pathlib.Path`
+            Path of the data file.
+
+        Returns
+        -------
+        str, optional
+            The checksum, or ``None`` if it is not known for the current version of
+            the file.
+        """
+        if not self.enabled:
+            return None
+        path, mtime, size = _ChecksumCache._key(filepath)
+        entry = self._checksums.get(path)
+        if entry is None or entry[:2] != (mtime, size):
+            return None
+        self._checksums.move_to_end(path)
+        return entry[2]
+
+    def add(self, filepath: Path, checksum: str) -> None:
+        """
+        Add the checksum of a data file.
+
+        Parameters
+        ----------
+        filepath: `~pathlib.Path`
+            Path of the data file.
+        checksum: str
+            The checksum of the file's current content.
+        """
+        if not self.enabled:
+            return
+        path, mtime, size = _ChecksumCache._key(filepath)
+        self._checksums[path] = (mtime, size, checksum)
+        self._checksums.move_to_end(path)
+        self._new_checksums[path] = (mtime, size, checksum)
+        while len(self._checksums) > _MAX_CHECKSUMS:
+            self._checksums.popitem(last=False)
+
+    def load(self, store: Any) -> None:
+        """
+        Load the checksums saved in pytest's cache.
+
+        Parameters
+        ----------
+        store: `pytest.Cache`
+            pytest's cache.
+        """
+        for path, entry in store.get(_CHECKSUMS_KEY, {}).items():
+            self._checksums[path] = (entry[0], entry[1], entry[2])
+        while len(self._checksums) > _MAX_CHECKSUMS:
+            self._checksums.popitem(last=False)
+
+    def save(self, store: Any) -> None:
+        """
+        Save the checksums added since they were last saved to pytest's cache.
+
+        The checksums are merged with those saved in the meantime by other
+        processes.
+
+        Parameters
+        ----------
+        store: `pytest.Cache`
+            pytest's cache.
+        """
+        if not self._new_checksums:
+            return
+        checksums = OrderedDict(store.get(_CHECKSUMS_KEY, {}))
+        for path, entry in self._new_checksums.items():
+            checksums.pop(path, None)
+            checksums[path] = list(entry)
+        while len(checksums) > _MAX_CHECKSUMS:
+            checksums.popitem(last=False)
+        store.set(_CHECKSUMS_KEY, checksums)
+        self._new_checksums.clear()
+
+    def clear(self) -> None:
+        """Remove all checksums from the cache."""
+        self._checksums.clear()
+        self._new_checksums.clear()
+
+
+_checksum_cache = _ChecksumCache()
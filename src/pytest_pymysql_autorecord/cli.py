@@ -0,0 +1,326 @@
+import argparse
+import os
+import pickle
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from .manifest import _Manifest
+from .util import _compact_rows, _data_filename, _dump_data, _load_data
+
+# Keys of values which were recorded by earlier versions of the plugin, but which
+# are not used any longer.
+_OBSOLETE_KEYS = {
+    "connection--escape",
+    "connection--escape_string",
+    "connection--literal",
+    "cursor--mogrify",
+}
+
+_ROW_KEYS = {"cursor--fetchone", "cursor--fetchmany", "cursor--fetchall"}
+
+
+def _data_files(data_dir: Path) -> List[Path]:
+    return sorted(data_dir.rglob("*.db"))
+
+
+def _module_data_dir(data_dir: Path, node_id: str) -> Path:
+    module_path = Path(node_id.split("::")[0])
+    return data_dir / module_path.parent / module_path.stem
+
+
+def _expected_data_files(data_dir: Path, node_ids: Iterable[str]) -> Set[Path]:
+    """
+    Return the paths of the data files for the given test node ids.
+
+    Parameters
+    ----------
+    data_dir: `~pathlib.Path`
+        Directory containing the recorded data files.
+    node_ids: iterable of str
+        Node ids, such as ``tests/test_user.py::TestUser::test_create[admin]``.
+
+    Returns
+    -------
+    set of `~pathlib.Path`
+        The data file paths.
+    """
+    filepaths = set()
+    for node_id in node_ids:
+        parts = node_id.split("::")
+        if len(parts) < 2:
+            continue
+        filepaths.add(_module_data_dir(data_dir, node_id) / _data_filename(parts[-1]))
+    return filepaths
+
+
+def _collect_node_ids(pytest_args: List[str]) -> Optional[List[str]]:
+    # Only whole modules may be collected, as the data files of the tests in a
+    # collected module which are not collected would be considered orphaned.
+    if any("::" in arg for arg in pytest_args):
+        sys.stderr.write("Test node ids cannot be passed as pytest arguments.\n")
+        return None
+    completed = subprocess.run(
+        [sys.executable, "-m", "pytest", "--collect-only", "-q", *pytest_args],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if completed.returncode != 0:
+        sys.stderr.write(
+            f"pytest failed to collect the tests (exit code {completed.returncode}).\n"
+        )
+        return None
+    lines = completed.stdout.splitlines()
+    if any(re.search(r"\b\d+ deselected\b", line) for line in lines):
+        sys.stderr.write(
+            "Some tests were deselected (for example with -k or -m). Collect all "
+            "the tests of the test modules instead.\n"
+        )
+        return None
+    return [line.strip() for line in lines if "::" in line]
+
+
+def _inspect_file(filepath: Path) -> Tuple[Path, int, Optional[int]]:
+    size = filepath.stat().st_size
+    try:
+        data = _load_data(filepath)
+    except Exception:
+        return filepath, size, None
+    return filepath, size, sum(len(values) for values in data.values())
+
+
+def _tmp_filepath(filepath: Path) -> Path:
+    return filepath.with_name(filepath.name + ".tmp")
+
+
+def _compact_file(filepath: Path, protocol: int) -> Tuple[Path, int, Optional[int]]:
+    old_size = filepath.stat().st_size
+    # Write to a temporary file first, so that an interrupted run cannot leave a
+    # truncated data file behind.
+    tmp_filepath = _tmp_filepath(filepath)
+    try:
+        data = _load_data(filepath)
+        columns_cache: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+        for key in list(data.keys()):
+            if key in _OBSOLETE_KEYS:
+                del data[key]
+            elif key in _ROW_KEYS:
+                data[key] = [_compact_rows(rows, columns_cache) for rows in data[key]]
+        _dump_data(data, tmp_filepath, protocol)
+        os.replace(tmp_filepath, filepath)
+    except Exception:
+        if tmp_filepath.exists():
+            tmp_filepath.unlink()
+        return filepath, old_size, None
+    return filepath, old_size, filepath.stat().st_size
+
+
+def _report(data_dir: Path, workers: Optional[int]) -> int:
+    sizes: Dict[Path, int] = defaultdict(int)
+    counts: Dict[Path, int] = defaultdict(int)
+    corrupt: List[Path] = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for filepath, size, values in executor.map(
+            _inspect_file, _data_files(data_dir)
+        ):
+            module_dir = filepath.parent.relative_to(data_dir)
+            sizes[module_dir] += size
+            counts[module_dir] += 1
+            if values is None:
+                corrupt.append(filepath)
+
+    for module_dir in sorted(sizes, key=lambda d: sizes[d], reverse=True):
+        sys.stdout.write(
+            f"{sizes[module_dir]:>12}  {counts[module_dir]:>6} files  {module_dir}\n"
+        )
+    sys.stdout.write(
+        f"{sum(sizes.values()):>12}  {sum(counts.values()):>6} files  (total)\n"
+    )
+    for filepath in corrupt:
+        sys.stdout.write(f"corrupt: {filepath}\n")
+    return 1 if corrupt else 0
+
+
+def _gc(data_dir: Path, node_ids: List[str], dry_run: bool, sweep_all: bool) -> int:
+    if not node_ids:
+        sys.stderr.write("No tests were collected; no data files are removed.\n")
+        return 1
+    expected = _expected_data_files(data_dir, node_ids)
+    # Unless all data files are swept, only the directories of the collected test
+    # modules are considered, as other modules may just not have been collected.
+    module_dirs = {_module_data_dir(data_dir, node_id) for node_id in node_ids}
+    orphans = [
+        f
+        for f in _data_files(data_dir)
+        if f not in expected and (sweep_all or f.parent in module_dirs)
+    ]
+    manifest = _Manifest(data_dir)
+    total_size = 0
+    for filepath in orphans:
+        sys.stdout.write(f"orphan: {filepath}\n")
+        total_size += filepath.stat().st_size
+        if not dry_run:
+            filepath.unlink()
+            manifest.remove(filepath)
+    if not dry_run:
+        manifest.save()
+        for directory in sorted(data_dir.rglob("*"), reverse=True):
+            if directory.is_dir() and not any(directory.iterdir()):
+                directory.rmdir()
+    sys.stdout.write(
+        f"{len(orphans)} orphaned data files ({total_size} bytes) "
+        f"{'found' if dry_run else 'removed'}.\n"
+    )
+    return 0
+
+
+def _compact(data_dir: Path, protocol: int, workers: Optional[int]) -> int:
+    filepaths = _data_files(data_dir)
+    # Remove the temporary files left behind by an interrupted run.
+    for filepath in filepaths:
+        if _tmp_filepath(filepath).exists():
+            _tmp_filepath(filepath).unlink()
+    manifest = _Manifest(data_dir)
+    old_total = 0
+    new_total = 0
+    compacted = 0
+    corrupt: List[Path] = []
+    # The manifest must match the files rewritten so far, even if a worker fails.
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for filepath, old_size, new_size in executor.map(
+                _compact_file, filepaths, [protocol] * len(filepaths)
+            ):
+                if new_size is None:
+                    corrupt.append(filepath)
+                    continue
+                manifest.refresh(filepath)
+                compacted += 1
+                old_total += old_size
+                new_total += new_size
+    finally:
+        manifest.save()
+    sys.stdout.write(
+        f"Compacted {compacted} data files from {old_total} to {new_total} bytes.\n"
+    )
+    for filepath in corrupt:
+        sys.stdout.write(f"corrupt: {filepath}\n")
+    return 1 if corrupt else 0
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="pytest-pymysql-autorecord",
+        description="Maintain the data files recorded by pytest-pymysql-autorecord.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_subparser(
+        name: str, help: str, parallel: bool = True
+    ) -> argparse.ArgumentParser:
+        subparser = subparsers.add_parser(name, help=help, description=help)
+        subparser.add_argument(
+            "data_dir", type=Path, help="Directory containing the data files."
+        )
+        if parallel:
+            subparser.add_argument(
+                "--workers",
+                type=int,
+                default=None,
+                help="Number of worker processes (default: number of CPUs).",
+            )
+        return subparser
+
+    add_subparser("report", "Report the size of the data files by test module.")
+
+    gc_parser = add_subparser(
+        "gc",
+        "Remove the data files of tests which do not exist any longer.",
+        parallel=False,
+    )
+    gc_parser.add_argument(
+        "--node-ids",
+        type=Path,
+        help="File with one test node id per line. By default pytest is run with "
+        "--collect-only to find the node ids.",
+    )
+    gc_parser.add_argument(
+        "--all",
+        action="store_true",
+        dest="sweep_all",
+        help="Also remove the data files of test modules for which no tests were "
+        "collected. By default only the directories of the collected test modules "
+        "are checked.",
+    )
+    gc_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only list the orphaned data files, without removing them.",
+    )
+    gc_parser.add_argument(
+        "pytest_args",
+        nargs="*",
+        help="Additional arguments for pytest when collecting the tests. Put -- "
+        "before them if they start with a dash.",
+    )
+
+    compact_parser = add_subparser(
+        "compact",
+        "Rewrite the data files in the current format, dropping values which are "
+        "not used any longer.",
+    )
+    compact_parser.add_argument(
+        "--protocol",
+        type=int,
+        default=pickle.DEFAULT_PROTOCOL,
+        help="Pickle protocol for the rewritten files.",
+    )
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Run the command line tool for maintaining recorded data files.
+
+    Parameters
+    ----------
+    argv: list of str, optional
+        Command line arguments. By default, the arguments passed to the Python
+        interpreter are used.
+
+    Returns
+    -------
+    int
+        The exit code.
+    """
+    args: Any = _parser().parse_args(argv)
+    data_dir: Path = args.data_dir
+    if not data_dir.is_dir():
+        sys.stderr.write(f"{data_dir} is not a directory.\n")
+        return 1
+
+    if args.command == "report":
+        return _report(data_dir, args.workers)
+    if args.command == "gc":
+        if args.node_ids:
+            node_ids = [
+                line.strip()
+                for line in args.node_ids.read_text().splitlines()
+                if line.strip()
+            ]
+        else:
+            collected = _collect_node_ids(args.pytest_args)
+            if collected is None:
+                return 1
+            node_ids = collected
+        return _gc(data_dir, node_ids, args.dry_run, args.sweep_all)
+    return _compact(data_dir, args.protocol, args.workers)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
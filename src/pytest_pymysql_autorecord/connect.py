@@ -1,18 +1,44 @@
-from typing import Any
+from typing import Any, Dict, Optional
 
 import pymysql
-from pymysql import err
+from pymysql import converters, err
+from pymysql.charset import charset_by_name
+from pymysql.constants import SERVER_STATUS
 from pymysql.protocol import MysqlPacket
 
-from .util import DatabaseMock, Mode
+from .fallback import _FallbackResult, _is_read_query
+from .tracing import _trace
+from .util import DatabaseMock, Mode, _PendingResult
+
+_SAVEPOINT = "pytest_pymysql_autorecord"
 
 
 class _MockCursor:
-    def __init__(self, database_mock: DatabaseMock):
+    def __init__(
+        self,
+        database_mock: DatabaseMock,
+        connection: Any = None,
+        cursorclass: Any = None,
+    ):
         self._database_mock = database_mock
+        self._connection = connection
+        self._dict_rows = cursorclass is not None and issubclass(
+            cursorclass, pymysql.cursors.DictCursorMixin
+        )
+        self._fallback_result: Optional[_FallbackResult] = None
+
+    def _read(self, key: str, sql: Any = None) -> Any:
+        value = _trace(
+            f"cursor--{key}", sql, self._database_mock._read_value, f"cursor--{key}"
+        )
+        if isinstance(value, Exception):
+            raise value
+        return value
 
-    def _read(self, key: str) -> Any:
-        value = self._database_mock._read_value(f"cursor--{key}")
+    def _read_rows(self, key: str) -> Any:
+        value = _trace(
+            f"cursor--{key}", None, self._database_mock._read_rows, f"cursor--{key}"
+        )
         if isinstance(value, Exception):
             raise value
         return value
@@ -27,6 +53,8 @@ class _MockCursor:
 
     @property
     def description(self) -> Any:
+        if self._fallback_result is not None:
+            return self._fallback_result.description
         return self._read("description")
 
     @description.setter
@@ -35,6 +63,8 @@ class _MockCursor:
 
     @property
     def rownumber(self) -> Any:
+        if self._fallback_result is not None:
+            return self._fallback_result.rownumber
         return self._read("rownumber")
 
     @rownumber.setter
@@ -43,6 +73,8 @@ class _MockCursor:
 
     @property
     def rowcount(self) -> Any:
+        if self._fallback_result is not None:
+            return self._fallback_result.rowcount
         return self._read("rowcount")
 
     @rowcount.setter
@@ -59,6 +91,8 @@ class _MockCursor:
 
     @property
     def lastrowid(self) -> Any:
+        if self._fallback_result is not None:
+            return None
         return self._read("lastrowid")
 
     @lastrowid.setter
@@ -88,26 +122,84 @@ class _MockCursor:
     def nextset(self) -> Any:
         return self._read("nextset")
 
+    def _get_db(self) -> Any:
+        return self._connection
+
     def mogrify(self, query: Any, args: Any = None) -> Any:
-        return self._read("mogrify")
+        # The argument binding of PyMySQL's cursor differs between versions, so
+        # that it is done here with the connection's escape method.
+        if args is None:
+            return query
+        conn = self._get_db()
+        if isinstance(args, dict):
+            args = {key: conn.escape(arg, conn.encoders) for key, arg in args.items()}
+        elif isinstance(args, (list, tuple)):
+            args = tuple(conn.escape(arg, conn.encoders) for arg in args)
+        else:
+            args = conn.escape(args, conn.encoders)
+        try:
+            return query % args
+        except TypeError as e:
+            raise err.ProgrammingError(str(e))
 
     def execute(self, query: Any, args: Any = None) -> Any:
-        return self._read("execute")
+        self._database_mock._check_query(query)
+        self._fallback_result = None
+        if self._database_mock._fallback:
+            sql = self.mogrify(query, args)
+            statement = self._database_mock._peek_value("cursor--query")
+            if _is_read_query(sql) and (statement is None or statement.sql != sql):
+                # A changed read query takes the place of the recorded one.
+                if statement is not None and _is_read_query(statement.sql):
+                    self._database_mock._skip_statement()
+                return _trace("fallback--execute", sql, self._fallback_execute, sql)
+            self._database_mock._read_statement(sql)
+        return self._read("execute", query)
+
+    def _fallback_execute(self, sql: str) -> Any:
+        description, rows = self._database_mock._fallback_query(sql)
+        self._fallback_result = _FallbackResult(description, rows, self._dict_rows)
+        return self._fallback_result.rowcount
 
     def executemany(self, query: Any, args: Any) -> Any:
-        return self._read("executemany")
+        self._database_mock._check_query(query)
+        self._fallback_result = None
+        if self._database_mock._fallback:
+            self._database_mock._read_statement(query)
+        value = _trace(
+            "cursor--executemany",
+            query,
+            self._database_mock._read_batch,
+            "cursor--executemany",
+            query,
+            args,
+        )
+        if isinstance(value, Exception):
+            raise value
+        return value
 
     def callproc(self, procname: Any, args: Any = ()) -> Any:
-        return self._read("callproc")
+        self._fallback_result = None
+        if self._database_mock._fallback:
+            self._database_mock._read_statement(procname)
+        return self._read("callproc", procname)
 
     def fetchone(self) -> Any:
-        return self._read("fetchone")
+        if self._fallback_result is not None:
+            return _trace("fallback--fetchone", None, self._fallback_result.fetchone)
+        return self._read_rows("fetchone")
 
     def fetchmany(self, size: Any = None) -> Any:
-        return self._read("fetchmany")
+        if self._fallback_result is not None:
+            return _trace(
+                "fallback--fetchmany", None, self._fallback_result.fetchmany, size or 1
+            )
+        return self._read_rows("fetchmany")
 
     def fetchall(self) -> Any:
-        return self._read("fetchall")
+        if self._fallback_result is not None:
+            return _trace("fallback--fetchall", None, self._fallback_result.fetchall)
+        return self._read_rows("fetchall")
 
     def scroll(self, value: Any, mode: Any = "relative") -> None:
         pass
@@ -133,11 +225,24 @@ class _RecordingCursor:
     ):
         self._database_mock = database_mock
         self._cursor = cursorclass(*args, **kwargs)
+        self._result = _PendingResult()
 
     def _record(self, key: str, f: Any, *args: Any, **kwargs: Any) -> Any:
+        sql = args[0] if key in ("execute", "callproc") else None
         try:
-            res = f(*args, **kwargs)
+            res = _trace(f"cursor--{key}", sql, f, *args, **kwargs)
             self._database_mock._record_value(f"cursor--{key}", res)
+            if key in ("execute", "rowcount"):
+                self._database_mock._record_rowcount(f"cursor--{key}", self._result)
+        except Exception as e:
+            self._database_mock._record_value(f"cursor--{key}", e)
+            raise
+        return res
+
+    def _record_rows(self, key: str, f: Any, *args: Any, **kwargs: Any) -> Any:
+        try:
+            res = _trace(f"cursor--{key}", None, f, *args, **kwargs)
+            self._database_mock._record_rows(f"cursor--{key}", res, self._result)
         except Exception as e:
             self._database_mock._record_value(f"cursor--{key}", e)
             raise
@@ -196,6 +301,7 @@ class _RecordingCursor:
         return self._record("max_stmt_length", lambda: self._cursor.max_stmt_length)
 
     def close(self) -> None:
+        self._database_mock._finish_rows(self._result)
         self._cursor.close()
 
     def __enter__(self) -> Any:
@@ -203,6 +309,7 @@ class _RecordingCursor:
 
     def __exit__(self, *exc_info: Any) -> None:
         del exc_info
+        self._database_mock._finish_rows(self._result)
         self._cursor.close()
 
     def setinputsizes(self, *args: Any) -> None:
@@ -212,28 +319,56 @@ class _RecordingCursor:
         pass
 
     def nextset(self) -> Any:
+        self._database_mock._finish_rows(self._result)
         return self._record("nextset", self._cursor.nextset)
 
     def mogrify(self, query: Any, args: Any = None) -> Any:
-        return self._record("mogrify", self._cursor.mogrify, query, args)
+        return self._cursor.mogrify(query, args)
 
     def execute(self, query: Any, args: Any = None) -> Any:
+        self._database_mock._finish_rows(self._result)
+        self._database_mock._queries.add(query)
+        if self._database_mock._fallback:
+            sql = self._cursor.mogrify(query, args)
+            self._database_mock._record_statement(sql)
+            if _is_read_query(sql):
+                connection = self._cursor.connection
+                if isinstance(connection, _RecordingConnection):
+                    connection = connection._connection
+                self._database_mock._capture_tables(connection, sql)
         return self._record("execute", self._cursor.execute, query, args)
 
     def executemany(self, query: Any, args: Any) -> Any:
-        return self._record("executemany", self._cursor.executemany, query, args)
+        self._database_mock._finish_rows(self._result)
+        self._database_mock._queries.add(query)
+        if self._database_mock._fallback:
+            self._database_mock._record_statement(query)
+        if args is not None and not isinstance(args, (list, tuple)):
+            args = list(args)
+        try:
+            res = _trace(
+                "cursor--executemany", query, self._cursor.executemany, query, args
+            )
+        except Exception as e:
+            self._database_mock._record_value("cursor--executemany", e)
+            raise
+        self._database_mock._record_batch("cursor--executemany", query, args, res)
+        return res
 
     def callproc(self, procname: Any, args: Any = ()) -> Any:
+        self._database_mock._finish_rows(self._result)
+        if self._database_mock._fallback:
+            self._database_mock._record_statement(procname)
         return self._record("callproc", self._cursor.callproc, procname, args)
 
     def fetchone(self) -> Any:
-        return self._record("fetchone", self._cursor.fetchone)
+        return self._record_rows("fetchone", self._cursor.fetchone)
 
     def fetchmany(self, size: Any = None) -> Any:
-        return self._record("fetchmany", self._cursor.fetchmany, size)
+        return self._record_rows("fetchmany", self._cursor.fetchmany, size)
 
     def fetchall(self) -> Any:
-        return self._record("fetchall", self._cursor.fetchall)
+        return self._record_rows("fetchall", self._cursor.fetchall)
 
     def scroll(self, value: Any, mode: Any = "relative") -> Any:
         self._record("scroll", self._cursor.scroll, value, mode)
@@ -254,11 +389,37 @@ class _RecordingCursor:
 
 
 class _MockConnection:
-    def __init__(self, database_mock: DatabaseMock):
+    def __init__(
+        self, database_mock: DatabaseMock, conv: Any = None, cursorclass: Any = None
+    ):
         self._database_mock = database_mock
+        self._cursorclass = cursorclass
+
+        # The escape context is needed for computing escaped values locally. Data
+        # recorded with earlier versions of the plugin has no escape context, in
+        # which case PyMySQL's defaults are used.
+        escape_context: Dict[str, Any] = {}
+        if self._database_mock._has_value("connection--escape_context"):
+            escape_context = self._read("escape_context")
+        self.charset = escape_context.get(
+            "charset", pymysql.connections.DEFAULT_CHARSET
+        )
+        self.encoding = escape_context.get(
+            "encoding", charset_by_name(self.charset).encoding
+        )
+        self.server_status = escape_context.get("server_status", 0)
+        self._binary_prefix = escape_context.get("binary_prefix", False)
+        if conv is None:
+            conv = converters.conversions
+        self.encoders = {k: v for (k, v) in conv.items() if type(k) is not int}
 
     def _read(self, key: str) -> Any:
-        return self._database_mock._read_value(f"connection--{key}")
+        return _trace(
+            f"connection--{key}",
+            None,
+            self._database_mock._read_value,
+            f"connection--{key}",
+        )
 
     def __enter__(self) -> Any:
         return self
@@ -306,17 +467,37 @@ class _MockConnection:
     def select_db(self, db: Any) -> None:
         pass
 
+    # The escape methods are pure functions of their arguments and the escape
+    # context, so PyMySQL's own implementation is used rather than replaying values.
+
     def escape(self, obj: Any, mapping: Any = None) -> Any:
-        return self._read("escape")
+        return pymysql.connections.Connection.escape(self, obj, mapping)  # type: ignore
 
     def literal(self, obj: Any) -> Any:
-        return self._read("literal")
+        return pymysql.connections.Connection.literal(self, obj)  # type: ignore
+
+    # Depending on the PyMySQL version, escape calls escape_string and _quote_bytes
+    # or _escape_string, so that all of them are implemented here.
 
     def escape_string(self, s: Any) -> Any:
-        return self._read("escape_string")
+        return self._escape_string(s)
+
+    def _escape_string(self, s: Any) -> Any:
+        if self.server_status & SERVER_STATUS.SERVER_STATUS_NO_BACKSLASH_ESCAPES:
+            return s.replace("'", "''")
+        return converters.escape_string(s)
+
+    def _quote_bytes(self, s: Any) -> Any:
+        if self.server_status & SERVER_STATUS.SERVER_STATUS_NO_BACKSLASH_ESCAPES:
+            return "'%s'" % (s.replace(b"'", b"''").decode("ascii", "surrogateescape"),)
+        return converters.escape_bytes(s)
 
     def cursor(self, cursor: Any = None) -> Any:
-        return _MockCursor(database_mock=self._database_mock)
+        return _MockCursor(
+            database_mock=self._database_mock,
+            connection=self,
+            cursorclass=cursor or self._cursorclass,
+        )
 
     def kill(self, thread_id: Any) -> Any:
         return self._read("kill")
@@ -373,9 +554,24 @@ class _RecordingConnection:
         self._cursorclass = cursorclass
         self._database_mock = database_mock
         self._connection = connection
+        self._isolated = database_mock._isolate
+        if self._isolated:
+            self._connection.autocommit(False)
+            self._connection.begin()
+            self._connection.query(f"SAVEPOINT {_SAVEPOINT}")
+            database_mock._isolated_connections.append(self._connection)
+        self._record("escape_context", self._escape_context)
+
+    def _escape_context(self) -> Dict[str, Any]:
+        return {
+            "charset": self._connection.charset,
+            "encoding": self._connection.encoding,
+            "server_status": self._connection.server_status,
+            "binary_prefix": getattr(self._connection, "_binary_prefix", False),
+        }
 
     def _record(self, key: str, f: Any, *args: Any, **kwargs: Any) -> Any:
-        res = f(*args, **kwargs)
+        res = _trace(f"connection--{key}", None, f, *args, **kwargs)
         self._database_mock._record_value(f"connection--{key}", res)
         return res
 
@@ -383,8 +579,16 @@ class _RecordingConnection:
     def _result(self) -> Any:
         return self._connection._result
 
+    @property
+    def charset(self) -> Any:
+        return self._connection.charset
+
+    @property
+    def encoding(self) -> Any:
+        return self._connection.encoding
+
     def __enter__(self) -> Any:
-        return self._connection
+        return self
 
     def __exit__(self, *exc_info: Any) -> None:
         del exc_info
@@ -406,6 +610,8 @@ class _RecordingConnection:
     __del__ = _force_close
 
     def autocommit(self, value: Any) -> None:
+        if self._isolated:
+            return
         self._connection.autocommit(value)
 
     def get_autocommit(self) -> Any:
@@ -418,12 +624,23 @@ class _RecordingConnection:
         self._connection._send_autocommit_mode()
 
     def begin(self) -> None:
+        if self._isolated:
+            return
         self._connection.begin()
 
     def commit(self) -> None:
+        if self._isolated:
+            # Keep the changes in the enclosing transaction, but make them the new
+            # state for subsequent rollbacks.
+            self._connection.query(f"RELEASE SAVEPOINT {_SAVEPOINT}")
+            self._connection.query(f"SAVEPOINT {_SAVEPOINT}")
+            return
         self._connection.commit()
 
     def rollback(self) -> None:
+        if self._isolated:
+            self._connection.query(f"ROLLBACK TO SAVEPOINT {_SAVEPOINT}")
+            return
         self._connection.rollback()
 
     def show_warnings(self) -> Any:
@@ -433,13 +650,16 @@ class _RecordingConnection:
         self._connection.select_db(db)
 
     def escape(self, obj: Any, mapping: Any = None) -> Any:
-        return self._record("escape", self._connection.escape, obj, mapping)
+        return self._connection.escape(obj, mapping)
 
     def literal(self, obj: Any) -> Any:
-        return self._record("literal", self._connection.literal, obj)
+        return self._connection.literal(obj)
 
     def escape_string(self, s: Any) -> Any:
-        return self._record("escape_string", self._connection.escape_string, s)
+        return self._connection.escape_string(s)
+
+    def _escape_string(self, s: Any) -> Any:
+        return self._connection._escape_string(s)
 
     def _quote_bytes(self, s: Any) -> Any:
         return self._connection._quote_bytes(s)
@@ -576,6 +796,10 @@ def mock_connect(database_mock: DatabaseMock, real_connect: Any) -> Any:
                 cursorclass=kwargs["cursorclass"],
             )
         elif mode == Mode.MOCK:
-            return _MockConnection(database_mock=database_mock)
+            return _MockConnection(
+                database_mock=database_mock,
+                conv=kwargs.get("conv"),
+                cursorclass=kwargs.get("cursorclass"),
+            )
 
     return f
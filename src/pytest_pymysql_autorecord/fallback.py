@@ -0,0 +1,524 @@
+import datetime
+import re
+import sqlite3
+from decimal import Decimal
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import pymysql
+from pymysql import err
+
+_IDENTIFIER = r"(?:`[^`]+`|\w+)"
+
+_TABLE_LIST_START = re.compile(r"\b(?:FROM|JOIN)\s+", re.IGNORECASE)
+
+_TABLE_REFERENCE = re.compile(
+    rf"({_IDENTIFIER}(?:\s*\.\s*{_IDENTIFIER})?)"
+    rf"(?:\s+(?:AS\s+)?(?!(?:WHERE|JOIN|ON|USING|GROUP|ORDER|LIMIT|HAVING|UNION|"
+    rf"INNER|LEFT|RIGHT|CROSS|NATURAL|STRAIGHT_JOIN|FOR|LOCK|WINDOW)\b)"
+    rf"({_IDENTIFIER}))?"
+    rf"\s*(,)?\s*",
+    re.IGNORECASE,
+)
+
+# Clauses which end the table list and conditions of a query.
+_CLAUSE_END = re.compile(
+    r"(?:GROUP|HAVING|ORDER|LIMIT|WINDOW|FOR|LOCK|INTO)\b", re.IGNORECASE
+)
+
+_SET_OPERATION = re.compile(r"(?:UNION|INTERSECT|EXCEPT)\b", re.IGNORECASE)
+
+_FROM = re.compile(r"FROM\b", re.IGNORECASE)
+
+_READ_QUERY = re.compile(r"^\s*\(?\s*(?:SELECT|WITH)\b", re.IGNORECASE)
+
+_MYSQL_ESCAPES = {
+    "0": "\0",
+    "b": "\b",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+    "Z": "\x1a",
+}
+
+
+class _TableData(NamedTuple):
+    """
+    Schema and rows of a database table, captured for the SQL fallback.
+
+    Attributes
+    ----------
+    name: tuple of str
+        The table name, preceded by the database name if the table was referenced
+        with one.
+    columns: list of tuple
+        Name and MySQL type of the columns.
+    rows: list of tuple
+        The captured table rows.
+    primary_key: tuple of int
+        Positions of the primary key columns.
+    """
+
+    name: Tuple[str, ...]
+    columns: List[Tuple[str, str]]
+    rows: List[Tuple[Any, ...]]
+    primary_key: Tuple[int, ...] = ()
+
+
+def _is_read_query(query: Any) -> bool:
+    return isinstance(query, str) and _READ_QUERY.match(query) is not None
+
+
+def _table_references(query: str) -> List[Tuple[Tuple[str, ...], Optional[str]]]:
+    """
+    Return the tables referenced in a FROM or JOIN clause of a query.
+
+    Parameters
+    ----------
+    query: str
+        SQL query.
+
+    Returns
+    -------
+    list of tuple
+        The table names, each split into its database and table name parts, together
+        with their alias (or ``None`` if there is none).
+    """
+    references: List[Tuple[Tuple[str, ...], Optional[str]]] = []
+    for start in _TABLE_LIST_START.finditer(query):
+        position = start.end()
+        while True:
+            m = _TABLE_REFERENCE.match(query, position)
+            if not m:
+                break
+            name = tuple(
+                part.strip().strip("`") for part in re.split(r"\s*\.\s*", m.group(1))
+            )
+            references.append((name, m.group(2)))
+            if not m.group(3):
+                break
+            position = m.end()
+    return references
+
+
+def _referenced_tables(query: str) -> List[Tuple[str, ...]]:
+    """
+    Return the names of the tables referenced in a FROM or JOIN clause of a query.
+
+    Parameters
+    ----------
+    query: str
+        SQL query.
+
+    Returns
+    -------
+    list of tuple of str
+        The table names, each split into its database and table name parts.
+    """
+    tables: List[Tuple[str, ...]] = []
+    for name, _ in _table_references(query):
+        if name not in tables:
+            tables.append(name)
+    return tables
+
+
+def _find_top_level(query: str, pattern: Any, start: int = 0) -> Optional[int]:
+    """
+    Return the position of the first match of a pattern outside of parentheses.
+
+    Matches in quoted strings and identifiers are ignored as well. ``None`` is
+    returned if there is no match.
+    """
+    depth = 0
+    i = start
+    while i < len(query):
+        c = query[i]
+        if c in ("'", '"', "`"):
+            i += 1
+            while i < len(query) and query[i] != c:
+                i += 2 if query[i] == "\\" and c != "`" else 1
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif (
+            depth == 0
+            and (i == 0 or not (query[i - 1].isalnum() or query[i - 1] == "_"))
+            and pattern.match(query, i)
+        ):
+            return i
+        i += 1
+    return None
+
+
+def _touched_rows_query(
+    query: str, name: Tuple[str, ...], alias: Optional[str]
+) -> Optional[str]:
+    """
+    Return a query for the rows of a table which are touched by a read query.
+
+    The query selects the distinct rows of the table for which the FROM and WHERE
+    clauses of the read query hold. Grouping, ordering and limits are ignored, so
+    that the rows may be more than those which make up the query result.
+
+    Parameters
+    ----------
+    query: str
+        Read query with bound parameters.
+    name: tuple of str
+        The table name, preceded by the database name if required.
+    alias: str, optional
+        The alias of the table in the query.
+
+    Returns
+    -------
+    str, optional
+        The query, or ``None`` if no query can be derived for the table.
+    """
+    if not re.match(r"\s*SELECT\b", query, re.IGNORECASE):
+        return None
+    if _find_top_level(query, _SET_OPERATION) is not None:
+        return None
+    start = _find_top_level(query, _FROM)
+    if start is None:
+        return None
+    end = _find_top_level(query, _CLAUSE_END, start)
+    table = alias if alias else _quote_identifier(name, "`")
+    return f"SELECT DISTINCT {table}.* {query[start:end].rstrip(' ;')}"
+
+
+def _quote_identifier(name: Tuple[str, ...], quote: str) -> str:
+    return ".".join(f"{quote}{part}{quote}" for part in name)
+
+
+def _capture_table(
+    connection: Any,
+    name: Tuple[str, ...],
+    rows_query: Optional[str] = None,
+    max_rows: Optional[int] = None,
+) -> Optional[_TableData]:
+    """
+    Capture the schema and rows of a database table.
+
+    Parameters
+    ----------
+    connection: `~pymysql.connections.Connection`
+        The (real) database connection.
+    name: tuple of str
+        The table name, preceded by the database name if required.
+    rows_query: str, optional
+        Query for the rows to capture, as returned by `_touched_rows_query`. All
+        rows are captured if no query is given or if the query fails.
+    max_rows: int, optional
+        Maximum number of rows to capture.
+
+    Returns
+    -------
+    `~pytest_pymysql_autorecord.fallback._TableData`, optional
+        The captured table, or ``None`` if the name does not refer to a table.
+    """
+    table = _quote_identifier(name, "`")
+    limit = "" if max_rows is None else f" LIMIT {max_rows}"
+    cursor = connection.cursor(pymysql.cursors.Cursor)
+    try:
+        cursor.execute(f"SHOW COLUMNS FROM {table}")
+        column_rows = cursor.fetchall()
+        columns = [(str(row[0]), str(row[1])) for row in column_rows]
+        primary_key = tuple(i for i, row in enumerate(column_rows) if row[3] == "PRI")
+        rows = None
+        if rows_query is not None:
+            try:
+                cursor.execute(rows_query + limit)
+                rows = list(cursor.fetchall())
+            except err.Error:
+                pass
+        if rows is None:
+            cursor.execute(f"SELECT * FROM {table}{limit}")
+            rows = list(cursor.fetchall())
+    except err.Error:
+        return None
+    finally:
+        cursor.close()
+    return _TableData(name=name, columns=columns, rows=rows, primary_key=primary_key)
+
+
+def _to_sqlite(query: str) -> str:
+    """
+    Translate a MySQL query with bound parameters into the SQLite dialect.
+
+    String literals are rewritten without backslash escapes, double-quoted strings
+    become single-quoted strings and backtick-quoted identifiers become
+    double-quoted identifiers. Functions are not translated; MySQL functions
+    without an SQLite equivalent are registered by
+    `~pytest_pymysql_autorecord.fallback._SQLiteFallback` instead.
+
+    Parameters
+    ----------
+    query: str
+        MySQL query.
+
+    Returns
+    -------
+    str
+        SQLite query.
+    """
+    translated: List[str] = []
+    i = 0
+    while i < len(query):
+        c = query[i]
+        if c == "`":
+            start = i + 1
+            i = query.index("`", start)
+            identifier = query[start:i].replace('"', '""')
+            translated.append(f'"{identifier}"')
+            i += 1
+        elif c in ("'", '"'):
+            value: List[str] = []
+            i += 1
+            while i < len(query):
+                if query[i] == "\\" and i + 1 < len(query):
+                    value.append(_MYSQL_ESCAPES.get(query[i + 1], query[i + 1]))
+                    i += 2
+                elif query.startswith(c + c, i):
+                    value.append(c)
+                    i += 2
+                elif query[i] == c:
+                    i += 1
+                    break
+                else:
+                    value.append(query[i])
+                    i += 1
+            literal = "".join(value).replace("'", "''")
+            translated.append(f"'{literal}'")
+        elif query.startswith("_binary'", i):
+            i += len("_binary")
+        else:
+            translated.append(c)
+            i += 1
+    return "".join(translated)
+
+
+def _sqlite_type(mysql_type: str) -> str:
+    # SQLite only needs the type name for choosing the column affinity, and it
+    # cannot parse parameter lists such as those of ENUM columns.
+    m = re.match(r"\w+", mysql_type)
+    return m.group() if m else ""
+
+
+def _to_sqlite_value(value: Any) -> Any:
+    if value is None or isinstance(value, (int, float, str, bytes)):
+        return value
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        # PyMySQL returns TIME values as timedeltas.
+        microseconds = abs(value) // datetime.timedelta(microseconds=1)
+        seconds, microseconds = divmod(microseconds, 1000000)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        sign = "-" if value < datetime.timedelta(0) else ""
+        fraction = f".{microseconds:06d}" if microseconds else ""
+        return f"{sign}{hours}:{minutes:02d}:{seconds:02d}{fraction}"
+    return str(value)
+
+
+def _from_sqlite_value(value: Any, mysql_type: Optional[str]) -> Any:
+    """
+    Convert a value returned by SQLite to the type PyMySQL returns for a column.
+
+    Parameters
+    ----------
+    value: any
+        The value returned by SQLite.
+    mysql_type: str, optional
+        The MySQL type of the column, as returned by ``SHOW COLUMNS``.
+
+    Returns
+    -------
+    any
+        The converted value, or the value itself if it cannot be converted.
+    """
+    if value is None or mysql_type is None:
+        return value
+    m = re.match(r"(\w+)(?:\(\s*\d+\s*(?:,\s*(\d+)\s*)?\))?", mysql_type)
+    if not m:
+        return value
+    type_name = m.group(1).lower()
+    try:
+        if type_name in ("decimal", "numeric", "dec", "fixed"):
+            if not isinstance(value, (int, float, str)):
+                return value
+            decimal = Decimal(str(value))
+            if m.group(2) is not None:
+                decimal = decimal.quantize(Decimal(1).scaleb(-int(m.group(2))))
+            return decimal
+        if not isinstance(value, str):
+            return value
+        if type_name == "date":
+            return datetime.date.fromisoformat(value)
+        if type_name in ("datetime", "timestamp"):
+            return datetime.datetime.fromisoformat(value)
+        if type_name == "time":
+            t = re.fullmatch(r"(-)?(\d+):(\d+):(\d+)(?:\.(\d{1,6}))?", value)
+            if not t:
+                return value
+            delta = datetime.timedelta(
+                hours=int(t.group(2)),
+                minutes=int(t.group(3)),
+                seconds=int(t.group(4)),
+                microseconds=int((t.group(5) or "0").ljust(6, "0")),
+            )
+            return -delta if t.group(1) else delta
+        if type_name == "year":
+            return int(value)
+    except (ArithmeticError, ValueError):
+        return value
+    return value
+
+
+def _concat(*args: Any) -> Any:
+    if any(arg is None for arg in args):
+        return None
+    return "".join(str(arg) for arg in args)
+
+
+def _concat_ws(separator: Any, *args: Any) -> Any:
+    if separator is None:
+        return None
+    return str(separator).join(str(arg) for arg in args if arg is not None)
+
+
+def _regexp(pattern: Any, value: Any) -> Any:
+    if pattern is None or value is None:
+        return None
+    return re.search(str(pattern), str(value), re.IGNORECASE) is not None
+
+
+class _SQLiteFallback:
+    """
+    In-memory SQLite database for answering queries which have not been recorded.
+
+    Parameters
+    ----------
+    tables: list of `~pytest_pymysql_autorecord.fallback._TableData`
+        The captured tables.
+    """
+
+    def __init__(self, tables: List[_TableData]):
+        self._connection = sqlite3.connect(":memory:")
+        self._register_functions()
+        schemas: Set[str] = set()
+        # MySQL types of the column names, or None if columns with the same name
+        # have different types.
+        self._column_types: Dict[str, Optional[str]] = {}
+        for table in tables:
+            for column, column_type in table.columns:
+                key = column.lower()
+                if self._column_types.get(key, column_type) != column_type:
+                    self._column_types[key] = None
+                else:
+                    self._column_types[key] = column_type
+            if len(table.name) > 1 and table.name[0] not in schemas:
+                self._connection.execute(
+                    f"ATTACH DATABASE ':memory:' AS \"{table.name[0]}\""
+                )
+                schemas.add(table.name[0])
+            columns = ", ".join(f'"{c}" {_sqlite_type(t)}' for c, t in table.columns)
+            name = _quote_identifier(table.name, '"')
+            self._connection.execute(f"CREATE TABLE IF NOT EXISTS {name} ({columns})")
+            placeholders = ", ".join("?" for _ in table.columns)
+            self._connection.executemany(
+                f"INSERT INTO {name} VALUES ({placeholders})",
+                [tuple(_to_sqlite_value(v) for v in row) for row in table.rows],
+            )
+
+    def _register_functions(self) -> None:
+        functions: Dict[str, Tuple[int, Any]] = {
+            "CONCAT": (-1, _concat),
+            "CONCAT_WS": (-1, _concat_ws),
+            "IF": (3, lambda condition, a, b: a if condition else b),
+            "LCASE": (1, lambda s: None if s is None else str(s).lower()),
+            "UCASE": (1, lambda s: None if s is None else str(s).upper()),
+            "NOW": (0, lambda: datetime.datetime.now().isoformat(sep=" ")[:19]),
+            "CURDATE": (0, lambda: datetime.date.today().isoformat()),
+            "REGEXP": (2, _regexp),
+        }
+        for name, (num_params, f) in functions.items():
+            self._connection.create_function(name, num_params, f)
+
+    def execute(self, query: str) -> Tuple[Any, List[Tuple[Any, ...]]]:
+        """
+        Execute a query.
+
+        Parameters
+        ----------
+        query: str
+            MySQL query with bound parameters.
+
+        Returns
+        -------
+        tuple
+            The cursor description and the result rows.
+        """
+        try:
+            cursor = self._connection.execute(_to_sqlite(query))
+        except sqlite3.Error as e:
+            raise err.ProgrammingError(
+                f"The query could not be answered from the stored data: {e}"
+            ) from e
+        description = tuple(
+            (d[0], None, None, None, None, None, True) for d in cursor.description
+        )
+        types = [self._column_types.get(d[0].lower()) for d in cursor.description]
+        rows = [
+            tuple(_from_sqlite_value(v, t) for v, t in zip(row, types))
+            for row in cursor.fetchall()
+        ]
+        return description, rows
+
+
+class _FallbackResult:
+    """
+    Result of a query answered by the SQL fallback, as seen by a cursor.
+
+    Parameters
+    ----------
+    description: tuple
+        The cursor description.
+    rows: list of tuple
+        The result rows.
+    as_dicts: bool
+        Whether rows should be returned as dictionaries.
+    """
+
+    def __init__(
+        self, description: Any, rows: List[Tuple[Any, ...]], as_dicts: bool
+    ) -> None:
+        self.description = description
+        self.rowcount = len(rows)
+        self.rownumber = 0
+        if as_dicts:
+            names = [d[0] for d in description]
+            self._rows: List[Any] = [dict(zip(names, row)) for row in rows]
+        else:
+            self._rows = rows
+
+    def fetchone(self) -> Any:
+        if self.rownumber >= len(self._rows):
+            return None
+        self.rownumber += 1
+        return self._rows[self.rownumber - 1]
+
+    def fetchmany(self, size: int) -> List[Any]:
+        start = self.rownumber
+        end = min(start + size, len(self._rows))
+        self.rownumber = end
+        return self._rows[start:end]
+
+    def fetchall(self) -> List[Any]:
+        start = self.rownumber
+        self.rownumber = len(self._rows)
+        return self._rows[start:]
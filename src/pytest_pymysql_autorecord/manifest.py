@@ -0,0 +1,284 @@
+import hashlib
+import json
+import os
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+import pymysql
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+# Version of the data file format. It must be increased whenever a change to the
+# plugin makes previously stored data files unusable.
+_FORMAT_VERSION = 1
+
+_MANIFEST_FILENAME = "manifest.json"
+
+
+def _checksum(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def _query_fingerprint(query: Any) -> str:
+    return hashlib.sha256(str(query).encode()).hexdigest()[:16]
+
+
+def _query_fingerprints(queries: Iterable[Any]) -> List[str]:
+    return sorted({_query_fingerprint(query) for query in queries})
+
+
+@contextmanager
+def _file_lock(filepath: Path) -> Iterator[None]:
+    """
+    Hold an exclusive lock on a file, waiting until it is available.
+
+    The file is created if it does not exist yet.
+
+    Parameters
+    ----------
+    filepath: `~pathlib.Path`
+        Path of the lock file.
+    """
+    with open(filepath, "a+b") as f:
+        if sys.platform == "win32":
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK only retries for about ten seconds.
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class _Manifest:
+    """
+    Manifest of the data files in a data directory.
+
+    For every data file the manifest contains its size and SHA-256 checksum, the
+    version of the data file format and of PyMySQL used for storing it, and
+    fingerprints of the queries which were executed. The manifest is stored as a
+    JSON file in the data directory, and it allows to validate the data files
+    without reading them.
+
+    Parameters
+    ----------
+    data_dir: `~pathlib.Path`
+        Directory containing the data files.
+    """
+
+    def __init__(self, data_dir: Path):
+        self._data_dir = data_dir
+        self._filepath = data_dir / _MANIFEST_FILENAME
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._updated: Dict[str, Dict[str, Any]] = {}
+        self._removed: List[str] = []
+        if self._filepath.exists():
+            self._entries = self._read_entries()
+
+    @property
+    def exists(self) -> bool:  # noqa: D102
+        return self._filepath.exists()
+
+    def _key(self, filepath: Path) -> str:
+        return filepath.relative_to(self._data_dir).as_posix()
+
+    def _read_entries(self) -> Dict[str, Dict[str, Any]]:
+        with open(self._filepath) as f:
+            return dict(json.load(f)["files"])
+
+    def add(self, filepath: Path, queries: Iterable[Any] = ()) -> None:
+        """
+        Add or update the entry for a data file.
+
+        Parameters
+        ----------
+        filepath: `~pathlib.Path`
+            Path of the data file.
+        queries: iterable
+            The queries executed when the data was stored.
+        """
+        entry = {
+            "size": filepath.stat().st_size,
+            "checksum": _checksum(filepath.read_bytes()),
+            "format_version": _FORMAT_VERSION,
+            "pymysql_version": pymysql.__version__,
+            "query_fingerprints": _query_fingerprints(queries),
+        }
+        key = self._key(filepath)
+        self._entries[key] = entry
+        self._updated[key] = entry
+
+    def refresh(self, filepath: Path) -> None:
+        """
+        Update the size, checksum and format version for a rewritten data file.
+
+        Nothing is done if the manifest has no entry for the data file.
+
+        Parameters
+        ----------
+        filepath: `~pathlib.Path`
+            Path of the data file.
+        """
+        key = self._key(filepath)
+        if key not in self._entries:
+            return
+        entry = dict(self._entries[key])
+        entry["size"] = filepath.stat().st_size
+        entry["checksum"] = _checksum(filepath.read_bytes())
+        entry["format_version"] = _FORMAT_VERSION
+        self._entries[key] = entry
+        self._updated[key] = entry
+
+    def remove(self, filepath: Path) -> None:
+        """
+        Remove the entry for a data file.
+
+        Parameters
+        ----------
+        filepath: `~pathlib.Path`
+            Path of the data file.
+        """
+        key = self._key(filepath)
+        self._entries.pop(key, None)
+        self._updated.pop(key, None)
+        self._removed.append(key)
+
+    def save(self) -> None:
+        """
+        Save the manifest.
+
+        The changes made with this object are merged into the manifest file, so that
+        changes made in the meantime by other processes are preserved. A lock file
+        ensures that processes saving at the same time do not lose each other's
+        changes.
+        """
+        if not self._updated and not (self._removed and self.exists):
+            return
+        self._data_dir.mkdir(parents=True, exist_ok=True)
+        lock_filepath = self._filepath.with_name(f"{_MANIFEST_FILENAME}.lock")
+        with _file_lock(lock_filepath):
+            entries = self._read_entries() if self._filepath.exists() else {}
+            for key in self._removed:
+                entries.pop(key, None)
+            entries.update(self._updated)
+            tmp_filepath = self._filepath.with_name(
+                f"{_MANIFEST_FILENAME}.{os.getpid()}"
+            )
+            with open(tmp_filepath, "w") as f:
+                json.dump(
+                    {"format_version": _FORMAT_VERSION, "files": entries},
+                    f,
+                    indent=1,
+                    sort_keys=True,
+                )
+            os.replace(tmp_filepath, self._filepath)
+        self._entries = entries
+        self._updated = {}
+        self._removed = []
+
+    def query_fingerprints(self, filepath: Path) -> Optional[Set[str]]:
+        """
+        Return the fingerprints of the queries executed when a data file was stored.
+
+        Parameters
+        ----------
+        filepath: `~pathlib.Path`
+            Path of the data file.
+
+        Returns
+        -------
+        set of str, optional
+            The query fingerprints, or ``None`` if the manifest has no entry for the
+            data file.
+        """
+        entry = self._entries.get(self._key(filepath))
+        if entry is None:
+            return None
+        return set(entry["query_fingerprints"])
+
+    def verify(
+        self, filepath: Path, content: bytes, checksum: Optional[str] = None
+    ) -> None:
+        """
+        Verify the checksum of a data file.
+
+        Parameters
+        ----------
+        filepath: `~pathlib.Path`
+            Path of the data file.
+        content: bytes
+            Content of the data file.
+        checksum: str, optional
+            The checksum of the content, if it is known already.
+
+        Raises
+        ------
+        ValueError
+            If the checksum differs from the one in the manifest.
+        """
+        entry = self._entries.get(self._key(filepath))
+        if entry is None:
+            return
+        if checksum is None:
+            checksum = _checksum(content)
+        if checksum != entry["checksum"]:
+            raise ValueError(
+                f"The checksum of the data file {filepath} does not match the one "
+                f"in the manifest. The file may be corrupt."
+            )
+
+    def problems(self, filepaths: Iterable[Path]) -> List[str]:
+        """
+        Return the problems of data files which can be detected without reading them.
+
+        A data file is considered missing if it does not exist, corrupt if its size
+        differs from the one in the manifest, and stale if it has been stored with a
+        different data file format or PyMySQL version. Data files which are not
+        included in the manifest are not checked.
+
+        Parameters
+        ----------
+        filepaths: iterable of `~pathlib.Path`
+            Paths of the data files to check.
+
+        Returns
+        -------
+        list of str
+            Descriptions of the problems found.
+        """
+        problems = []
+        for filepath in filepaths:
+            key = self._key(filepath)
+            entry = self._entries.get(key)
+            if not filepath.exists():
+                problems.append(f"missing: {key}")
+            elif entry is None:
+                continue
+            elif filepath.stat().st_size != entry["size"]:
+                problems.append(f"corrupt: {key}")
+            elif entry["format_version"] != _FORMAT_VERSION:
+                problems.append(
+                    f"stale: {key} (format version {entry['format_version']})"
+                )
+            elif entry["pymysql_version"] != pymysql.__version__:
+                problems.append(
+                    f"stale: {key} (PyMySQL version {entry['pymysql_version']})"
+                )
+        return problems
@@ -1,13 +1,19 @@
 import os
 from pathlib import Path
-from typing import Generator, cast
+from typing import Generator, Optional, cast
 
 import pymysql
 import pytest
 from pytest import FixtureRequest, MonkeyPatch
 
+from .cache import _checksum_cache
 from .connect import mock_connect
-from .util import DatabaseMock, Mode
+from .manifest import _Manifest
+from .util import DatabaseMock, Mode, _data_filename, _module_data_dir, _RowPolicy
+
+_manifest_key = pytest.StashKey[_Manifest]()
+
+_SAMPLES = ("head", "tail", "head_tail")
 
 
 def pytest_addoption(parser: pytest.Parser) -> None:
@@ -38,6 +44,147 @@ def pytest_addoption(parser: pytest.Parser) -> None:
         dest="db_data_dir",
         help="Directory where to store the recorded data files.",
     )
+    group.addoption(
+        "--isolate-db-data",
+        action="store_true",
+        dest="isolate_db_data",
+        help="Roll back all database changes made by a test when storing data.",
+    )
+    group.addoption(
+        "--fallback-db-data",
+        action="store_true",
+        dest="fallback_db_data",
+        help="Answer read queries which have not been recorded from stored tables.",
+    )
+    group.addoption(
+        "--db-data-max-rows",
+        action="store",
+        type=int,
+        dest="db_data_max_rows",
+        help="Maximum number of rows to store for a query result.",
+    )
+    group.addoption(
+        "--db-data-sample",
+        action="store",
+        choices=_SAMPLES,
+        default="head",
+        dest="db_data_sample",
+        help="Rows to store if a query result has more than the maximum number of "
+        "rows: the first (head), last (tail) or first and last (head_tail) rows.",
+    )
+    group.addoption(
+        "--db-data-checksum-cache",
+        action="store_true",
+        dest="db_data_checksum_cache",
+        help="Keep the checksums of the data files in pytest's cache, so that they "
+        "need not be computed again for unchanged data files when mocking.",
+    )
+
+
+def _db_data_dir(config: pytest.Config) -> Optional[Path]:
+    if config.option.db_data_dir:
+        return Path(config.option.db_data_dir)
+    if os.getenv("PMSM_DATA_DIR") is not None:
+        return Path(cast(str, os.getenv("PMSM_DATA_DIR")))
+    return None
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    """
+    Register the plugin's marker, load the manifest and set up the checksum cache.
+
+    Parameters
+    ----------
+    config: `pytest.Config`
+        pytest configuration.
+    """
+    config.addinivalue_line(
+        "markers",
+        "db_data_rows(max_rows, sample='head'): limit the number of rows stored for "
+        "a query result. sample may be 'head', 'tail' or 'head_tail'.",
+    )
+
+    db_data_dir = _db_data_dir(config)
+    is_storing = config.option.store_db_data
+    is_mocking = config.option.mock_db_data
+    if db_data_dir and (is_storing or is_mocking):
+        config.stash[_manifest_key] = _Manifest(db_data_dir)
+
+    _checksum_cache.enabled = config.option.db_data_checksum_cache
+    _checksum_cache.clear()
+    if _checksum_cache.enabled and hasattr(config, "cache"):
+        _checksum_cache.load(config.cache)
+
+
+def pytest_collection_finish(session: pytest.Session) -> None:
+    """
+    Check the data files of the collected tests when the database is mocked.
+
+    The check only uses the manifest of the data files and does not read the files
+    themselves. The test session is stopped if any data files are missing, corrupt
+    or stale.
+
+    Parameters
+    ----------
+    session: `pytest.Session`
+        pytest session.
+    """
+    config = session.config
+    manifest = config.stash.get(_manifest_key, None)
+    db_data_dir = _db_data_dir(config)
+    if not config.option.mock_db_data or not manifest or not manifest.exists:
+        return
+    assert db_data_dir is not None
+
+    filepaths = [
+        _module_data_dir(db_data_dir, config.rootpath, item.path)
+        / _data_filename(item.name)
+        for item in session.items
+        if not item.get_closest_marker("skip") and not item.get_closest_marker("skipif")
+    ]
+    problems = manifest.problems(filepaths)
+    if problems:
+        pytest.exit(
+            "The stored database data cannot be used for mocking:\n"
+            + "\n".join(problems)
+            + "\nStore the database data for these tests again."
+        )
+
+
+def pytest_sessionfinish(session: pytest.Session) -> None:
+    """
+    Save the manifest of the data files and the cached checksums.
+
+    Parameters
+    ----------
+    session: `pytest.Session`
+        pytest session.
+    """
+    manifest = session.config.stash.get(_manifest_key, None)
+    if manifest is not None:
+        manifest.save()
+    if _checksum_cache.enabled and hasattr(session.config, "cache"):
+        _checksum_cache.save(session.config.cache)
+
+
+def _row_policy(request: FixtureRequest) -> Optional[_RowPolicy]:
+    max_rows = request.config.option.db_data_max_rows
+    sample = request.config.option.db_data_sample
+    marker = request.node.get_closest_marker("db_data_rows")
+    if marker is not None:
+        max_rows = marker.kwargs.get(
+            "max_rows", marker.args[0] if marker.args else None
+        )
+        sample = marker.kwargs.get("sample", sample)
+    if max_rows is None:
+        return None
+    if not isinstance(max_rows, int) or isinstance(max_rows, bool) or max_rows < 0:
+        pytest.fail(
+            f"The maximum number of rows must be a non-negative integer: {max_rows!r}"
+        )
+    if sample not in _SAMPLES:
+        pytest.fail(f"Unsupported sample for the db_data_rows marker: {sample}")
+    return _RowPolicy(max_rows=max_rows, sample=sample)
 
 
 @pytest.fixture(autouse=True)
@@ -66,6 +213,30 @@ def database_mock(
     directory is created if necessary. Alternatively, you can set the environment
     variable ``PMSM_DB_DATA_DIR``.
 
+    If the ``--isolate-db-data`` flag is used together with the ``--store-db-data``
+    flag, every database connection is wrapped in a transaction, which is rolled
+    back at the end of the test. Commits and rollbacks made by the test are turned
+    into savepoint operations within this transaction. As the transaction stays open
+    until the end of the test, other connections neither see the changes nor can
+    change the same rows.
+
+    If the ``--fallback-db-data`` flag is used together with the ``--store-db-data``
+    flag, the tables used by read queries are stored along with the data. If it is
+    used together with the ``--mock-db-data`` flag, read queries which have not been
+    recorded are answered by an in-memory SQLite database containing these tables.
+
+    When database data is stored, a manifest with the size, checksum and format
+    version of every data file is updated as well. When the database is mocked, the
+    data files of all collected tests are checked against this manifest before any
+    test is run.
+
+    The number of rows stored for a query result can be limited with the
+    ``--db-data-max-rows`` and ``--db-data-sample`` options, or for a single test with
+    the ``db_data_rows`` marker.
+
+    If the ``--db-data-checksum-cache`` flag is used, the checksums of the data files
+    are kept in pytest's cache, so that other test runs need not compute them again.
+
     Parameters
     ----------
     original_datadir: `~pathlib.Path`
@@ -77,13 +248,10 @@ def database_mock(
     """
     is_storing = request.config.option.store_db_data
     is_mocking = request.config.option.mock_db_data
-    db_data_dir = (
-        Path(request.config.option.db_data_dir)
-        if request.config.option.db_data_dir
-        else None
-    )
-    if not db_data_dir and os.getenv("PMSM_DATA_DIR") is not None:
-        db_data_dir = Path(cast(str, os.getenv("PMSM_DATA_DIR")))
+    is_isolating = request.config.option.isolate_db_data
+    is_falling_back = request.config.option.fallback_db_data
+    db_data_dir = _db_data_dir(request.config)
+    manifest = request.config.stash.get(_manifest_key, None)
 
     if is_storing and is_mocking:
         pytest.fail(
@@ -96,6 +264,16 @@ def database_mock(
             "--store-db-data or --mock-db-data flag. Alternatively, you can "
             "set the environment variable PMSM_DATA_DIR."
         )
+    if is_isolating and not is_storing:
+        pytest.fail(
+            "The command line flag --isolate-db-data can only be used with the "
+            "--store-db-data flag."
+        )
+    if is_falling_back and not (is_storing or is_mocking):
+        pytest.fail(
+            "The command line flag --fallback-db-data can only be used with the "
+            "--store-db-data or --mock-db-data flag."
+        )
 
     if is_storing:
         mode = Mode.STORE_DATA
@@ -106,11 +284,23 @@ def database_mock(
 
     os.environ["PMSM_MODE"] = mode.value
 
-    db_mock_fixture = DatabaseMock(mode, db_data_dir, request)
+    db_mock_fixture = DatabaseMock(
+        mode,
+        db_data_dir,
+        request,
+        is_isolating,
+        is_falling_back,
+        manifest,
+        _row_policy(request) if is_storing else None,
+    )
     connect = mock_connect(db_mock_fixture, pymysql.connect)
     monkeypatch.setattr(pymysql, "connect", connect)
 
     yield db_mock_fixture
 
+    db_mock_fixture._rollback_isolated_connections()
+
     if is_storing:
         db_mock_fixture._write_data()
+        if manifest is not None:
+            manifest.add(db_mock_fixture._filepath(), db_mock_fixture._queries)
@@ -0,0 +1,254 @@
+import json
+import os
+import pickle
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Union
+
+_ROW_KEYS = {
+    "cursor--fetchone",
+    "cursor--fetchmany",
+    "cursor--fetchall",
+    "fallback--fetchone",
+    "fallback--fetchmany",
+    "fallback--fetchall",
+}
+
+
+class TraceEvent(NamedTuple):
+    """
+    Event fired before and after a database call is recorded or replayed.
+
+    Attributes
+    ----------
+    phase: str
+        ``"start"`` before and ``"end"`` after the call.
+    key: str
+        Key of the call, such as ``"cursor--execute"`` or
+        ``"connection--get_server_info"``. Queries answered by the SQL fallback
+        and fetching their rows have keys starting with ``"fallback--"``, such as
+        ``"fallback--execute"``.
+    sql: any
+        The SQL statement for calls which execute one, ``None`` otherwise.
+    timestamp: float
+        Time of the event, in seconds, as returned by `time.perf_counter`.
+    duration: float, optional
+        Duration of the call in seconds (``"end"`` events only).
+    row_count: int, optional
+        Number of rows returned by a fetch call, or the return value of an
+        ``execute`` or ``executemany`` call (``"end"`` events only).
+    bytes: int, optional
+        Size of the pickled rows returned by a fetch call (``"end"`` events of fetch
+        calls only).
+    error: bool
+        Whether the call raised an exception (``"end"`` events only).
+    """
+
+    phase: str
+    key: str
+    sql: Any
+    timestamp: float
+    duration: Optional[float] = None
+    row_count: Optional[int] = None
+    bytes: Optional[int] = None
+    error: bool = False
+
+
+TraceListener = Callable[[TraceEvent], None]
+
+_listeners: List[TraceListener] = []
+
+
+def add_trace_listener(listener: TraceListener) -> None:
+    """
+    Add a listener for trace events.
+
+    The listener is called with a `~pytest_pymysql_autorecord.TraceEvent` before
+    and after every database call which is recorded or replayed. As long as no
+    listener has been added, no events are created.
+
+    Parameters
+    ----------
+    listener: function
+        Function accepting a `~pytest_pymysql_autorecord.TraceEvent`.
+    """
+    _listeners.append(listener)
+
+
+def remove_trace_listener(listener: TraceListener) -> None:
+    """
+    Remove a listener for trace events.
+
+    Parameters
+    ----------
+    listener: function
+        A listener previously added with
+        `~pytest_pymysql_autorecord.add_trace_listener`.
+    """
+    _listeners.remove(listener)
+
+
+def _row_count(key: str, value: Any) -> Optional[int]:
+    if key in _ROW_KEYS:
+        if isinstance(value, (list, tuple)):
+            return len(value)
+        return 0 if value is None else 1
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    return None
+
+
+def _size(key: str, value: Any) -> Optional[int]:
+    # Pickling is only worth its cost for the rows, which make up most of the data.
+    if key not in _ROW_KEYS:
+        return None
+    try:
+        return len(pickle.dumps(value))
+    except Exception:
+        return None
+
+
+def _trace(key: str, sql: Any, f: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    if not _listeners:
+        return f(*args, **kwargs)
+
+    listeners = list(_listeners)
+    start = time.perf_counter()
+    start_event = TraceEvent(phase="start", key=key, sql=sql, timestamp=start)
+    for listener in listeners:
+        listener(start_event)
+    try:
+        value = f(*args, **kwargs)
+    except Exception:
+        end = time.perf_counter()
+        end_event = TraceEvent(
+            phase="end",
+            key=key,
+            sql=sql,
+            timestamp=end,
+            duration=end - start,
+            error=True,
+        )
+        for listener in listeners:
+            listener(end_event)
+        raise
+    end = time.perf_counter()
+    end_event = TraceEvent(
+        phase="end",
+        key=key,
+        sql=sql,
+        timestamp=end,
+        duration=end - start,
+        row_count=_row_count(key, value),
+        bytes=_size(key, value),
+        error=isinstance(value, Exception),
+    )
+    for listener in listeners:
+        listener(end_event)
+    return value
+
+
+class ChromeTraceListener:
+    """
+    Trace listener collecting events in the Chrome trace event format.
+
+    Every database call becomes a complete ("X") event, which can be viewed with
+    ``chrome://tracing`` or Perfetto. Call `write` to save the collected events.
+
+    .. code:: python
+
+       listener = ChromeTraceListener("db-trace.json")
+       add_trace_listener(listener)
+       ...
+       remove_trace_listener(listener)
+       listener.write()
+
+    Parameters
+    ----------
+    filepath: str or `~pathlib.Path`
+        Path of the JSON file to write the events to.
+    """
+
+    def __init__(self, filepath: Union[str, Path]):
+        self._filepath = Path(filepath)
+        self._events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event: TraceEvent) -> None:  # noqa: D102
+        if event.phase != "end":
+            return
+        duration = event.duration or 0
+        trace_event = {
+            "name": event.key,
+            "cat": "database",
+            "ph": "X",
+            "ts": (event.timestamp - duration) * 1e6,
+            "dur": duration * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {
+                "sql": None if event.sql is None else str(event.sql),
+                "row_count": event.row_count,
+                "bytes": event.bytes,
+                "error": event.error,
+            },
+        }
+        with self._lock:
+            self._events.append(trace_event)
+
+    def write(self) -> None:
+        """Write the collected events to the JSON file."""
+        with self._lock:
+            events = list(self._events)
+        with open(self._filepath, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+class OpenTelemetryTraceListener:
+    """
+    Trace listener creating a span for every database call.
+
+    The tracer must provide a ``start_span(name, attributes=...)`` method returning a
+    span with ``set_attribute`` and ``end`` methods, as OpenTelemetry tracers do. The
+    span is started with the current context as its parent, so that the database
+    calls are shown as children of the span of the running test.
+
+    .. code:: python
+
+       from opentelemetry import trace
+
+       add_trace_listener(OpenTelemetryTraceListener(trace.get_tracer(__name__)))
+
+    Parameters
+    ----------
+    tracer: any
+        OpenTelemetry tracer.
+    """
+
+    def __init__(self, tracer: Any):
+        self._tracer = tracer
+        self._local = threading.local()
+
+    def _spans(self) -> List[Any]:
+        if not hasattr(self._local, "spans"):
+            self._local.spans = []
+        return self._local.spans  # type: ignore
+
+    def __call__(self, event: TraceEvent) -> None:  # noqa: D102
+        spans = self._spans()
+        if event.phase == "start":
+            attributes = {"db.system": "mysql"}
+            if event.sql is not None:
+                attributes["db.statement"] = str(event.sql)
+            spans.append(self._tracer.start_span(event.key, attributes=attributes))
+            return
+        if not spans:
+            return
+        span = spans.pop()
+        if event.row_count is not None:
+            span.set_attribute("db.row_count", event.row_count)
+        if event.bytes is not None:
+            span.set_attribute("db.bytes", event.bytes)
+        span.set_attribute("error", event.error)
+        span.end()
@@ -1,15 +1,42 @@
 import enum
+import hashlib
 import os
 import pickle
 import re
+import sys
 import tempfile
 from collections import defaultdict
 from pathlib import Path
-from typing import Any, Dict, List, Optional, cast
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple, cast
 
 import pytest
 from pytest import FixtureRequest
 
+from .cache import _checksum_cache
+from .fallback import (
+    _capture_table,
+    _is_read_query,
+    _SQLiteFallback,
+    _table_references,
+    _TableData,
+    _touched_rows_query,
+)
+from .manifest import _checksum, _Manifest, _query_fingerprint
+
+# Keys of the values which may be recorded for the result of an executed statement.
+_RESULT_KEYS = (
+    "cursor--execute",
+    "cursor--description",
+    "cursor--rowcount",
+    "cursor--rownumber",
+    "cursor--lastrowid",
+    "cursor--fetchone",
+    "cursor--fetchmany",
+    "cursor--fetchall",
+    "cursor--nextset",
+    "cursor--scroll",
+)
+
 
 class Mode(enum.Enum):
     """An enumeration of the available modes.
@@ -22,6 +49,145 @@ class Mode(enum.Enum):
     NORMAL = "Normal"
 
 
+class _CompactRows(NamedTuple):
+    """
+    Rows returned by a dictionary cursor, stored as tuples.
+
+    The column names are stored once for all rows of a result set, and they are
+    shared between result sets with the same columns. Rows returned by consecutive
+    ``fetchone`` calls are stored together, and each call consumes one of them.
+
+    Attributes
+    ----------
+    columns: tuple of str
+        The column names.
+    rows: list of tuple
+        The row values, in the order of the column names.
+    container: type, optional
+        The type of the sequence containing the rows, or ``None`` if the rows were
+        returned one at a time.
+    """
+
+    columns: Tuple[str, ...]
+    rows: List[Tuple[Any, ...]]
+    container: Optional[type]
+
+
+class _ParameterBlock(NamedTuple):
+    """
+    Parameters passed to a cursor's ``executemany`` method, stored by column.
+
+    Attributes
+    ----------
+    query: str
+        The statement template.
+    layout: str
+        How the parameters for a row are given: ``"sequence"`` for sequences,
+        ``"mapping"`` for mappings and ``"scalar"`` for anything else.
+    keys: tuple, optional
+        The parameter names if the parameters for a row are given as a mapping.
+    columns: tuple of tuple
+        The parameter values, with one tuple for each parameter position or name.
+    row_count: int
+        The number of parameter rows.
+    digest: str
+        SHA-256 digest of the statement template and parameters.
+    result: any
+        The return value of the ``executemany`` call.
+    """
+
+    query: Any
+    layout: str
+    keys: Optional[Tuple[Any, ...]]
+    columns: Tuple[Tuple[Any, ...], ...]
+    row_count: int
+    digest: str
+    result: Any
+
+
+class _Statement(NamedTuple):
+    """
+    Statement executed with a cursor, recorded for the SQL fallback.
+
+    Attributes
+    ----------
+    sql: any
+        The statement with bound parameters, or the name of a called procedure.
+    positions: tuple of int
+        The number of values recorded for each of the result keys before the
+        statement was executed, in the order of the keys.
+    """
+
+    sql: Any
+    positions: Tuple[int, ...]
+
+
+class _RowPolicy(NamedTuple):
+    """
+    Policy for limiting the number of rows stored for a query result.
+
+    The policy applies to all the rows returned by a cursor's ``fetchall`` and
+    ``fetchmany`` methods for a result set, however many calls are made. Rows
+    returned by ``fetchone`` are always stored.
+
+    Attributes
+    ----------
+    max_rows: int
+        Maximum number of rows stored for a result.
+    sample: str
+        Which rows are stored if there are more than ``max_rows`` rows: ``"head"``
+        for the first rows, ``"tail"`` for the last rows, or ``"head_tail"`` for
+        the first and last rows.
+    """
+
+    max_rows: int
+    sample: str = "head"
+
+    def apply(self, rows: Any) -> Any:
+        """
+        Apply the policy to a sequence of rows.
+
+        Parameters
+        ----------
+        rows: any
+            The rows.
+
+        Returns
+        -------
+        any
+            The rows to store, in a sequence of the same type as ``rows``.
+        """
+        if not isinstance(rows, (list, tuple)) or len(rows) <= self.max_rows:
+            return rows
+        if self.sample == "head":
+            head, tail = self.max_rows, 0
+        elif self.sample == "tail":
+            head, tail = 0, self.max_rows
+        elif self.sample == "head_tail":
+            head = (self.max_rows + 1) // 2
+            tail = self.max_rows - head
+        else:
+            raise ValueError(f"Unsupported sample: {self.sample}")
+        tail_start = len(rows) - tail
+        return type(rows)(list(rows[:head]) + list(rows[tail_start:]))
+
+
+class _PendingResult:
+    """
+    Rows fetched for a result set, whose storage awaits the end of the result set.
+
+    The row policy can only be applied once all rows of a result set have been
+    fetched. Until then the rows returned by every fetch call are stored unchanged,
+    together with the position at which they are stored. The positions of the row
+    counts stored for the result set are kept as well, so that they can be made
+    consistent with the sampled rows.
+    """
+
+    def __init__(self) -> None:
+        self.chunks: List[Tuple[str, int, Any]] = []
+        self.rowcounts: List[Tuple[str, int]] = []
+
+
 class DatabaseMock:
     """
     Properties and methods for the database mock fixture.
@@ -34,6 +200,17 @@ class DatabaseMock:
         Directory for storing the recorded data files.
     request: `~pytest.FixtureRequest`
         pytest request fixture.
+    isolate: bool
+        Whether database connections made while storing data should be wrapped in a
+        transaction, which is rolled back at the end of the test.
+    fallback: bool
+        Whether the tables used by read queries should be stored along with the data,
+        so that queries which have not been recorded can be answered when mocking.
+    manifest: `~pytest_pymysql_autorecord.manifest._Manifest`, optional
+        Manifest of the data files, which is used for verifying the checksum of the
+        data file when mocking.
+    row_policy: `~pytest_pymysql_autorecord.util._RowPolicy`, optional
+        Policy for limiting the number of rows stored for a query result.
 
     Attributes
     ----------
@@ -46,16 +223,45 @@ class DatabaseMock:
         mode: Mode,
         db_data_dir: Optional[Path],
         request: FixtureRequest,
+        isolate: bool = False,
+        fallback: bool = False,
+        manifest: Optional[_Manifest] = None,
+        row_policy: Optional[_RowPolicy] = None,
     ):
         self._mode = mode
         self._request = request
+        self._isolate = isolate and mode == Mode.STORE_DATA
+        self._isolated_connections: List[Any] = []
+        self._fallback = fallback and mode != Mode.NORMAL
+        self._captured_tables: Dict[Tuple[str, ...], Optional[_TableData]] = {}
+        self._captured_rows: Dict[Tuple[str, ...], Dict[Any, int]] = {}
+        self._fallback_engine: Optional[_SQLiteFallback] = None
+        self._read_counts: Dict[str, int] = defaultdict(int)
+        self._manifest = manifest
+        self._queries: Set[Any] = set()
         self._data_dir = DatabaseMock._test_data_dir(db_data_dir, request)
 
+        self._columns: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+        self._fetchone_rows: Optional[_CompactRows] = None
+
+        self._query_fingerprints: Optional[Set[str]] = None
         if mode == Mode.MOCK:
             self._data = self._read_data()
+            # Data stored without the fallback has neither statements nor tables, and
+            # it must be replayed as it is.
+            self._fallback = self._fallback and bool(
+                self._data.get("cursor--query") and self._data.get("fallback--tables")
+            )
+            if manifest is not None:
+                self._query_fingerprints = manifest.query_fingerprints(self._filepath())
         else:
             self._data = defaultdict(list)
 
+        self._row_policy = row_policy if mode == Mode.STORE_DATA else None
+        self._pending_results: List[_PendingResult] = []
+        if self._row_policy is not None:
+            self._record_value("meta--row-policy", self._row_policy)
+
     @property
     def mode(self) -> Mode:  # noqa: D102
         return self._mode
@@ -108,32 +314,380 @@ class DatabaseMock:
     def _test_data_dir(db_data_dir: Optional[Path], request: FixtureRequest) -> Path:
         if not db_data_dir:
             return Path(tempfile.gettempdir())
-        parent_dir = request.path.parent.relative_to(request.config.rootpath)
-        node_dir = Path(request.module.__file__).stem
-        return db_data_dir / parent_dir / node_dir
+        return _module_data_dir(
+            db_data_dir, request.config.rootpath, Path(request.module.__file__)
+        )
 
     def _write_data(self) -> None:
-        filepath = self._filepath()
-        with open(filepath, "wb") as f:
-            pickle.dump(self._data, f)
+        for result in list(self._pending_results):
+            self._finish_rows(result)
+        _dump_data(self._data, self._filepath())
 
     def _read_data(self) -> Dict[str, List[Any]]:
         filepath = self._filepath()
-        with open(filepath, "rb") as f:
-            return cast(Dict[str, List[Any]], pickle.load(f))
+        content = filepath.read_bytes()
+        if self._manifest is not None:
+            checksum = _checksum_cache.checksum(filepath)
+            if checksum is None:
+                checksum = _checksum(content)
+                _checksum_cache.add(filepath, checksum)
+            try:
+                self._manifest.verify(filepath, content, checksum)
+            except ValueError as e:
+                pytest.fail(str(e))
+        return cast(Dict[str, List[Any]], pickle.loads(content))
+
+    def _rollback_isolated_connections(self) -> None:
+        for connection in self._isolated_connections:
+            if connection.open:
+                connection.rollback()
+        self._isolated_connections.clear()
 
     def _record_value(self, key: str, value: Any) -> None:
         self._data[key].append(value)
 
     def _read_value(self, key: str) -> Any:
+        self._read_counts[key] += 1
         return self._data[key].pop(0)
 
+    def _has_value(self, key: str) -> bool:
+        return bool(self._data.get(key))
+
+    def _peek_value(self, key: str) -> Any:
+        values = self._data.get(key)
+        return values[0] if values else None
+
+    def _check_query(self, query: Any) -> None:
+        if self._query_fingerprints is None:
+            return
+        if self._fallback and _is_read_query(query):
+            return
+        if _query_fingerprint(query) not in self._query_fingerprints:
+            pytest.fail(
+                f"The query {query!r} was not executed when the database data was "
+                f"stored. You may have to store the database data again."
+            )
+
+    def _record_statement(self, sql: Any) -> None:
+        # The rows fetched for different statements must not be stored together.
+        self._fetchone_rows = None
+        positions = tuple(len(self._data.get(key, ())) for key in _RESULT_KEYS)
+        self._record_value("cursor--query", _Statement(sql, positions))
+
+    def _read_statement(self, sql: Any) -> None:
+        statement = self._peek_value("cursor--query")
+        if statement is None:
+            return
+        if statement.sql != sql:
+            pytest.fail(
+                f"The statement {sql!r} differs from the statement "
+                f"{statement.sql!r} which was executed when the database data was "
+                f"stored."
+            )
+        self._read_value("cursor--query")
+
+    def _skip_statement(self) -> None:
+        """
+        Skip the recorded statement and the values recorded for its result.
+
+        The values for the result of a statement are those recorded before the next
+        statement, or all remaining values if there is no next statement.
+        """
+        self._read_value("cursor--query")
+        next_statement = self._peek_value("cursor--query")
+        for i, key in enumerate(_RESULT_KEYS):
+            if next_statement is not None:
+                end = next_statement.positions[i]
+            else:
+                end = self._read_counts[key] + len(self._data.get(key, ()))
+            while self._read_counts[key] < end:
+                self._read_value(key)
+
+    def _capture_tables(self, connection: Any, query: str) -> None:
+        """
+        Capture the rows touched by a read query in the tables it references.
+
+        The rows are merged with those captured for earlier queries, and rows with
+        the same primary key are replaced with their latest version. The number of
+        rows captured for a table is limited by the row policy.
+        """
+        max_rows = self._row_policy.max_rows if self._row_policy is not None else None
+        for name, alias in _table_references(query):
+            if name in self._captured_tables and self._captured_tables[name] is None:
+                continue
+            table = self._captured_tables.get(name)
+            limit = max_rows
+            if table is not None and max_rows is not None:
+                limit = max(max_rows - len(table.rows), 0)
+            captured = _capture_table(
+                connection, name, _touched_rows_query(query, name, alias), limit
+            )
+            if table is None:
+                self._captured_tables[name] = captured
+                if captured is not None:
+                    self._captured_rows[name] = {}
+                    rows = list(captured.rows)
+                    captured.rows.clear()
+                    self._merge_rows(captured, rows)
+                    self._record_value("fallback--tables", captured)
+            elif captured is not None:
+                self._merge_rows(table, captured.rows)
+
+    def _merge_rows(self, table: _TableData, rows: List[Tuple[Any, ...]]) -> None:
+        positions = self._captured_rows[table.name]
+        for row in rows:
+            if table.primary_key:
+                key: Any = tuple(row[i] for i in table.primary_key)
+            else:
+                key = row
+            try:
+                position = positions.get(key)
+            except TypeError:
+                table.rows.append(row)
+                continue
+            if position is None:
+                positions[key] = len(table.rows)
+                table.rows.append(row)
+            else:
+                table.rows[position] = row
+
+    def _fallback_query(self, query: str) -> Tuple[Any, List[Tuple[Any, ...]]]:
+        if self._fallback_engine is None:
+            self._fallback_engine = _SQLiteFallback(
+                self._data.get("fallback--tables", [])
+            )
+        return self._fallback_engine.execute(query)
+
+    def _record_rows(
+        self, key: str, rows: Any, result: Optional[_PendingResult] = None
+    ) -> None:
+        if self._row_policy is not None and key != "cursor--fetchone":
+            if result is not None and isinstance(rows, (list, tuple)):
+                if not result.chunks:
+                    self._pending_results.append(result)
+                rows = type(rows)(rows)
+                result.chunks.append((key, len(self._data[key]), rows))
+                self._record_value(key, rows)
+                return
+            rows = self._row_policy.apply(rows)
+        compact_rows = _compact_rows(rows, self._columns)
+        if key == "cursor--fetchone":
+            if (
+                isinstance(compact_rows, _CompactRows)
+                and self._fetchone_rows is not None
+                and self._fetchone_rows.columns is compact_rows.columns
+            ):
+                self._fetchone_rows.rows.extend(compact_rows.rows)
+                return
+            if isinstance(compact_rows, _CompactRows):
+                self._fetchone_rows = compact_rows
+            else:
+                self._fetchone_rows = None
+        self._record_value(key, compact_rows)
+
+    def _record_rowcount(self, key: str, result: _PendingResult) -> None:
+        """
+        Remember the position of the row count just stored for a result set.
+
+        The row count may be the value of the cursor's ``rowcount`` attribute or the
+        value returned by its ``execute`` method.
+        """
+        if self._row_policy is not None:
+            result.rowcounts.append((key, len(self._data[key]) - 1))
+
+    def _finish_rows(self, result: _PendingResult) -> None:
+        """
+        Store the rows fetched for a result set, applying the row policy.
+
+        The sampled rows take the place of the fetched ones, in the same order and
+        with the same number of rows per fetch call, so that the fetch calls after
+        the sampled rows return no rows when the database is mocked. The row counts
+        stored for the result set are reduced by the number of rows which have been
+        dropped.
+        """
+        rowcounts = result.rowcounts
+        result.rowcounts = []
+        if not result.chunks or self._row_policy is None:
+            return
+        self._pending_results.remove(result)
+        chunks = result.chunks
+        result.chunks = []
+        fetched = [row for _, _, chunk in chunks for row in chunk]
+        rows = self._row_policy.apply(fetched)
+        dropped = len(fetched) - len(rows)
+        for key, index in rowcounts:
+            rowcount = self._data[key][index]
+            if type(rowcount) is int and rowcount >= dropped:
+                self._data[key][index] = rowcount - dropped
+        start = 0
+        for key, index, chunk in chunks:
+            end = min(start + len(chunk), len(rows))
+            sampled = rows[start:end]
+            start = end
+            if isinstance(chunk, tuple):
+                sampled = tuple(sampled)
+            self._data[key][index] = _compact_rows(sampled, self._columns)
+
+    def _read_rows(self, key: str) -> Any:
+        value = self._peek_value(key)
+        if (
+            isinstance(value, _CompactRows)
+            and value.container is None
+            and len(value.rows) > 1
+        ):
+            return dict(zip(value.columns, value.rows.pop(0)))
+        value = self._read_value(key)
+        if isinstance(value, _CompactRows):
+            return DatabaseMock._expand_rows(value)
+        return value
+
+    @staticmethod
+    def _expand_rows(compact_rows: _CompactRows) -> Any:
+        columns = compact_rows.columns
+        rows = [dict(zip(columns, row)) for row in compact_rows.rows]
+        if compact_rows.container is None:
+            return rows[0]
+        return compact_rows.container(rows)
+
+    def _record_batch(self, key: str, query: Any, args: Any, result: Any) -> None:
+        self._record_value(key, DatabaseMock._parameter_block(query, args, result))
+
+    def _read_batch(self, key: str, query: Any, args: Any) -> Any:
+        value = self._read_value(key)
+        if not isinstance(value, _ParameterBlock):
+            return value
+        if DatabaseMock._parameter_block(query, args, None).digest != value.digest:
+            pytest.fail(
+                "executemany was called with a different statement or different "
+                "parameters than when the database data was stored."
+            )
+        return value.result
+
+    @staticmethod
+    def _parameter_block(query: Any, args: Any, result: Any) -> _ParameterBlock:
+        rows = list(args) if args else []
+        layout = "scalar"
+        keys: Optional[Tuple[Any, ...]] = None
+        columns: Tuple[Tuple[Any, ...], ...] = (tuple(rows),)
+        if rows and all(isinstance(row, (list, tuple)) for row in rows):
+            if all(len(row) == len(rows[0]) for row in rows):
+                layout = "sequence"
+                columns = tuple(zip(*rows))
+        elif rows and all(isinstance(row, dict) for row in rows):
+            if all(tuple(row.keys()) == tuple(rows[0].keys()) for row in rows):
+                layout = "mapping"
+                keys = tuple(rows[0].keys())
+                columns = tuple(tuple(row[k] for row in rows) for k in keys)
+
+        if isinstance(query, str):
+            query = sys.intern(query)
+        checksum = hashlib.sha256()
+        _update_digest(checksum, (query, layout, keys, columns))
+        return _ParameterBlock(
+            query=query,
+            layout=layout,
+            keys=keys,
+            columns=columns,
+            row_count=len(rows),
+            digest=checksum.hexdigest(),
+            result=result,
+        )
+
     def _filepath(self) -> Path:
-        # Adapted from the pytest-regressions source code
-        basename = re.sub(r"[\W]", "_", self._request.node.name)
         self._data_dir.mkdir(parents=True, exist_ok=True)
 
-        return self._data_dir / (basename + ".db")
+        return self._data_dir / _data_filename(self._request.node.name)
+
+
+def _module_data_dir(db_data_dir: Path, rootpath: Path, module_path: Path) -> Path:
+    parent_dir = module_path.parent.relative_to(rootpath)
+    return db_data_dir / parent_dir / module_path.stem
+
+
+def _data_filename(node_name: str) -> str:
+    # Adapted from the pytest-regressions source code
+    basename = re.sub(r"[\W]", "_", node_name)
+    return basename + ".db"
+
+
+def _dump_data(
+    data: Dict[str, List[Any]], filepath: Path, protocol: Optional[int] = None
+) -> None:
+    with open(filepath, "wb") as f:
+        pickle.dump(data, f, protocol=protocol)
+
+
+def _load_data(filepath: Path) -> Dict[str, List[Any]]:
+    with open(filepath, "rb") as f:
+        return cast(Dict[str, List[Any]], pickle.load(f))
+
+
+def _update_digest(checksum: Any, value: Any) -> None:
+    """
+    Add a canonical encoding of a value to a digest.
+
+    Unlike a pickle, the encoding only depends on the types and values, so that equal
+    values always have the same digest. Every value is preceded by its type and
+    length, and containers are encoded item by item.
+
+    Parameters
+    ----------
+    checksum: hash object
+        The digest, as created by `hashlib`.
+    value: any
+        The value to add.
+    """
+    value_type = type(value)
+    checksum.update(f"{value_type.__module__}.{value_type.__qualname__}".encode())
+    if isinstance(value, (list, tuple)):
+        checksum.update(b"[%d]" % len(value))
+        for item in value:
+            _update_digest(checksum, item)
+        return
+    if isinstance(value, dict):
+        checksum.update(b"{%d}" % len(value))
+        for key, item in value.items():
+            _update_digest(checksum, key)
+            _update_digest(checksum, item)
+        return
+    if isinstance(value, (bytes, bytearray)):
+        data = bytes(value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8", "surrogatepass")
+    else:
+        data = repr(value).encode("utf-8", "backslashreplace")
+    checksum.update(b"<%d>" % len(data))
+    checksum.update(data)
+
+
+def _compact_rows(
+    rows: Any, columns_cache: Dict[Tuple[str, ...], Tuple[str, ...]]
+) -> Any:
+    if type(rows) is dict:
+        columns = _intern_columns(tuple(rows.keys()), columns_cache)
+        return _CompactRows(columns, [tuple(rows.values())], None)
+    if not isinstance(rows, (list, tuple)) or not rows:
+        return rows
+    if any(type(row) is not dict for row in rows):
+        return rows
+    columns = tuple(rows[0].keys())
+    if any(tuple(row.keys()) != columns for row in rows):
+        return rows
+    return _CompactRows(
+        _intern_columns(columns, columns_cache),
+        [tuple(row.values()) for row in rows],
+        type(rows),
+    )
+
+
+def _intern_columns(
+    columns: Tuple[str, ...], columns_cache: Dict[Tuple[str, ...], Tuple[str, ...]]
+) -> Tuple[str, ...]:
+    if columns not in columns_cache:
+        columns_cache[columns] = tuple(
+            sys.intern(c) if isinstance(c, str) else c for c in columns
+        )
+    return columns_cache[columns]
 
 
 def skip_for_db_mocking() -> None:
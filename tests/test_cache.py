@@ -0,0 +1,73 @@
+import json
+from pathlib import Path
+from typing import Any, Dict
+
+import pytest
+
+from pytest_pymysql_autorecord.cache import _ChecksumCache
+
+
+def _data_file(tmp_path: Path, name: str, size: int) -> Path:
+    filepath = tmp_path / name
+    filepath.write_bytes(b"x" * size)
+    return filepath
+
+
+class _Store:
+    def __init__(self) -> None:
+        self.values: Dict[str, Any] = {}
+
+    def get(self, key: str, default: Any) -> Any:
+        return json.loads(json.dumps(self.values.get(key, default)))
+
+    def set(self, key: str, value: Any) -> None:
+        self.values[key] = value
+
+
+def test_checksums_are_shared_between_caches(tmp_path: Path) -> None:
+    """Test that saved checksums are used by another cache."""
+    store = _Store()
+    filepath = _data_file(tmp_path, "a.db", 10)
+    cache = _ChecksumCache(enabled=True)
+    cache.add(filepath, "abc")
+    cache.save(store)
+
+    other_cache = _ChecksumCache(enabled=True)
+    other_cache.load(store)
+    assert other_cache.checksum(filepath) == "abc"
+
+    filepath.write_bytes(b"y" * 11)
+    assert other_cache.checksum(filepath) is None
+
+
+def test_disabled_cache_has_no_checksums(tmp_path: Path) -> None:
+    """Test that a disabled cache neither keeps nor returns checksums."""
+    filepath = _data_file(tmp_path, "a.db", 10)
+    cache = _ChecksumCache()
+    cache.add(filepath, "abc")
+
+    assert cache.checksum(filepath) is None
+
+
+def test_checksums_are_saved_in_pytest_cache(pytester: pytest.Pytester) -> None:
+    """Test that the checksums of the data files read are saved in pytest's cache."""
+    pytester.makepyfile(test_example="""
+        def test_value(database_mock):
+            assert database_mock.user_value(42) == 42
+        """)
+    pytester.runpytest("--store-db-data", "--db-data-dir", "data")
+    result = pytester.runpytest(
+        "--mock-db-data", "--db-data-checksum-cache", "--db-data-dir", "data"
+    )
+    result.assert_outcomes(passed=1)
+
+    checksums = json.loads(
+        (
+            pytester.path
+            / ".pytest_cache"
+            / "v"
+            / "pytest_pymysql_autorecord"
+            / "checksums"
+        ).read_text()
+    )
+    assert len(checksums) == 1
@@ -0,0 +1,89 @@
+import pickle
+from collections import defaultdict
+from pathlib import Path
+
+from pytest_pymysql_autorecord.cli import main
+from pytest_pymysql_autorecord.manifest import _Manifest
+from pytest_pymysql_autorecord.util import _CompactRows, _load_data
+
+
+def _write_data_file(filepath: Path) -> None:
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    data = defaultdict(list)
+    data["connection--escape"].append("'x'")
+    data["cursor--fetchall"].append([{"id": 1}, {"id": 2}])
+    with open(filepath, "wb") as f:
+        pickle.dump(data, f)
+
+
+def test_gc_removes_orphaned_data_files(tmp_path: Path) -> None:
+    """Test that data files without a test are removed."""
+    data_dir = tmp_path / "data"
+    kept = data_dir / "tests" / "test_user" / "test_create_admin_.db"
+    orphaned = data_dir / "tests" / "test_shop" / "test_buy.db"
+    _write_data_file(kept)
+    _write_data_file(orphaned)
+    node_ids = tmp_path / "node_ids.txt"
+    node_ids.write_text("tests/test_user.py::TestUser::test_create[admin]\n")
+
+    assert main(["gc", str(data_dir), "--node-ids", str(node_ids), "--all"]) == 0
+    assert kept.exists()
+    assert not orphaned.exists()
+    assert not orphaned.parent.exists()
+
+
+def test_gc_only_checks_collected_modules(tmp_path: Path) -> None:
+    """Test that only the data files of collected test modules are removed."""
+    data_dir = tmp_path / "data"
+    kept = data_dir / "tests" / "test_user" / "test_create_admin_.db"
+    orphaned = data_dir / "tests" / "test_user" / "test_delete.db"
+    not_collected = data_dir / "tests" / "test_shop" / "test_buy.db"
+    for filepath in (kept, orphaned, not_collected):
+        _write_data_file(filepath)
+    node_ids = tmp_path / "node_ids.txt"
+    node_ids.write_text("tests/test_user.py::TestUser::test_create[admin]\n")
+
+    assert main(["gc", str(data_dir), "--node-ids", str(node_ids)]) == 0
+    assert kept.exists()
+    assert not orphaned.exists()
+    assert not_collected.exists()
+
+
+def test_gc_rejects_node_ids_as_pytest_arguments(tmp_path: Path) -> None:
+    """Test that no data files are removed if only some tests of a module are run."""
+    filepath = tmp_path / "tests" / "test_user" / "test_delete.db"
+    _write_data_file(filepath)
+
+    assert main(["gc", str(tmp_path), "--", "tests/test_user.py::test_create"]) == 1
+    assert filepath.exists()
+
+
+def test_compact_rewrites_data_files(tmp_path: Path) -> None:
+    """Test that data files are rewritten in the current format."""
+    filepath = tmp_path / "tests" / "test_user" / "test_create.db"
+    _write_data_file(filepath)
+
+    assert main(["compact", str(tmp_path), "--workers", "1"]) == 0
+    data = _load_data(filepath)
+    assert "connection--escape" not in data
+    assert isinstance(data["cursor--fetchall"][0], _CompactRows)
+
+
+def test_compact_reports_corrupt_data_files(tmp_path: Path) -> None:
+    """Test that a corrupt data file does not stop the other files being compacted."""
+    filepath = tmp_path / "tests" / "test_user" / "test_create.db"
+    _write_data_file(filepath)
+    corrupt = tmp_path / "tests" / "test_user" / "test_delete.db"
+    corrupt.write_bytes(b"not a pickle")
+    leftover = tmp_path / "tests" / "test_user" / "test_create.db.tmp"
+    leftover.write_bytes(b"")
+    manifest = _Manifest(tmp_path)
+    manifest.add(filepath)
+    manifest.save()
+
+    assert main(["compact", str(tmp_path), "--workers", "1"]) == 1
+    assert isinstance(_load_data(filepath)["cursor--fetchall"][0], _CompactRows)
+    assert corrupt.read_bytes() == b"not a pickle"
+    assert not leftover.exists()
+    assert not corrupt.with_name("test_delete.db.tmp").exists()
+    _Manifest(tmp_path).verify(filepath, filepath.read_bytes())
@@ -0,0 +1,259 @@
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pymysql
+import pytest
+from pytest import FixtureRequest
+
+from pytest_pymysql_autorecord.connect import (
+    _MockConnection,
+    _RecordingConnection,
+    _RecordingCursor,
+)
+from pytest_pymysql_autorecord.fallback import _TableData
+from pytest_pymysql_autorecord.util import DatabaseMock, Mode, _RowPolicy
+
+
+def _database_mock(request: FixtureRequest) -> DatabaseMock:
+    return DatabaseMock(Mode.STORE_DATA, None, request)
+
+
+def test_mock_connection_escapes_locally(request: FixtureRequest) -> None:
+    """Test that the mock connection escapes values without recorded data."""
+    connection = _MockConnection(_database_mock(request))
+    assert connection.escape("O'Brien") == "'O\\'Brien'"
+    assert connection.escape(42) == "42"
+    assert connection.escape(None) == "NULL"
+    assert connection.escape_string("O'Brien") == "O\\'Brien"
+
+
+def test_mock_connection_uses_recorded_escape_context(request: FixtureRequest) -> None:
+    """Test that the recorded server status is used for escaping."""
+    database_mock = _database_mock(request)
+    database_mock._record_value(
+        "connection--escape_context",
+        {
+            "charset": "utf8mb4",
+            "encoding": "utf8",
+            "server_status": 512,  # SERVER_STATUS_NO_BACKSLASH_ESCAPES
+            "binary_prefix": False,
+        },
+    )
+    connection = _MockConnection(database_mock)
+    assert connection.escape("O'Brien") == "'O''Brien'"
+
+
+def test_mock_cursor_mogrifies_locally(request: FixtureRequest) -> None:
+    """Test that the mock cursor mogrifies queries without recorded data."""
+    cursor = _MockConnection(_database_mock(request)).cursor()
+    assert (
+        cursor.mogrify("SELECT * FROM t WHERE a=%s AND b=%s", ("x", 1))
+        == "SELECT * FROM t WHERE a='x' AND b=1"
+    )
+    assert (
+        cursor.mogrify("SELECT * FROM t WHERE a=%(a)s", {"a": "x"})
+        == "SELECT * FROM t WHERE a='x'"
+    )
+
+
+class _FakeConnection:
+    charset = "utf8mb4"
+    encoding = "utf8"
+    server_status = 0
+    open = True
+
+    def __init__(self) -> None:
+        self.calls: List[str] = []
+
+    def autocommit(self, value: bool) -> None:
+        self.calls.append(f"autocommit {value}")
+
+    def begin(self) -> None:
+        self.calls.append("begin")
+
+    def commit(self) -> None:
+        self.calls.append("commit")
+
+    def rollback(self) -> None:
+        self.calls.append("rollback")
+
+    def query(self, sql: str) -> None:
+        self.calls.append(sql)
+
+    def close(self) -> None:
+        self.calls.append("close")
+
+    def _force_close(self) -> None:
+        pass
+
+
+def test_isolated_recording_connection_uses_savepoints(
+    request: FixtureRequest,
+) -> None:
+    """Test that commits and rollbacks are savepoint operations when isolating."""
+    database_mock = DatabaseMock(Mode.STORE_DATA, None, request, isolate=True)
+    fake_connection = _FakeConnection()
+    connection = _RecordingConnection(database_mock, fake_connection, None)
+    connection.autocommit(True)
+    connection.commit()
+    connection.rollback()
+    database_mock._rollback_isolated_connections()
+
+    assert fake_connection.calls == [
+        "autocommit False",
+        "begin",
+        "SAVEPOINT pytest_pymysql_autorecord",
+        "RELEASE SAVEPOINT pytest_pymysql_autorecord",
+        "SAVEPOINT pytest_pymysql_autorecord",
+        "ROLLBACK TO SAVEPOINT pytest_pymysql_autorecord",
+        "rollback",
+    ]
+
+
+def test_isolated_recording_connection_as_context_manager(
+    request: FixtureRequest,
+) -> None:
+    """Test that a connection used as a context manager remains isolated."""
+    database_mock = DatabaseMock(Mode.STORE_DATA, None, request, isolate=True)
+    fake_connection = _FakeConnection()
+    with _RecordingConnection(database_mock, fake_connection, None) as connection:
+        connection.commit()
+
+    assert "commit" not in fake_connection.calls
+    assert fake_connection.calls[-3:] == [
+        "RELEASE SAVEPOINT pytest_pymysql_autorecord",
+        "SAVEPOINT pytest_pymysql_autorecord",
+        "close",
+    ]
+
+
+def _fallback_database_mock(request: FixtureRequest) -> DatabaseMock:
+    database_mock = DatabaseMock(Mode.STORE_DATA, None, request, fallback=True)
+    database_mock._record_value(
+        "fallback--tables",
+        _TableData(name=("t",), columns=[("a", "int")], rows=[(1,), (2,), (3,)]),
+    )
+    database_mock._record_statement("SELECT a FROM t")
+    database_mock._record_value("cursor--execute", 3)
+    database_mock._record_rows("cursor--fetchall", ({"a": 1}, {"a": 2}, {"a": 3}))
+    database_mock._record_statement("INSERT INTO t (a) VALUES (4)")
+    database_mock._record_value("cursor--execute", 1)
+    return database_mock
+
+
+def test_mock_cursor_replays_recorded_queries(request: FixtureRequest) -> None:
+    """Test that recorded queries are replayed if the fallback is enabled."""
+    database_mock = _fallback_database_mock(request)
+    cursor = _MockConnection(database_mock).cursor(pymysql.cursors.DictCursor)
+    assert cursor.execute("SELECT a FROM t") == 3
+    assert cursor.fetchall() == ({"a": 1}, {"a": 2}, {"a": 3})
+    assert cursor.execute("INSERT INTO t (a) VALUES (%s)", (4,)) == 1
+
+
+def test_mock_cursor_answers_unrecorded_queries(request: FixtureRequest) -> None:
+    """Test that a changed read query is answered from the stored tables."""
+    database_mock = _fallback_database_mock(request)
+    cursor = _MockConnection(database_mock).cursor(pymysql.cursors.DictCursor)
+    assert cursor.execute("SELECT a FROM t WHERE a > %s", (1,)) == 2
+    assert cursor.fetchall() == [{"a": 2}, {"a": 3}]
+    assert cursor.execute("INSERT INTO t (a) VALUES (%s)", (4,)) == 1
+
+
+def test_mock_cursor_replays_data_stored_without_fallback(
+    request: FixtureRequest, tmp_path: Path
+) -> None:
+    """Test that data stored without the fallback is replayed with the fallback."""
+    database_mock = DatabaseMock(Mode.STORE_DATA, tmp_path, request)
+    database_mock._record_value("cursor--execute", 1)
+    database_mock._record_rows("cursor--fetchall", ((1,),))
+    database_mock._write_data()
+
+    database_mock = DatabaseMock(Mode.MOCK, tmp_path, request, fallback=True)
+    cursor = _MockConnection(database_mock).cursor()
+    assert cursor.execute("SELECT a FROM t WHERE a = %s", (1,)) == 1
+    assert cursor.fetchall() == ((1,),)
+
+
+def test_mock_cursor_fails_for_changed_write_queries(request: FixtureRequest) -> None:
+    """Test that a changed query which is not a read query fails the test."""
+    database_mock = _fallback_database_mock(request)
+    cursor = _MockConnection(database_mock).cursor(pymysql.cursors.DictCursor)
+    cursor.execute("SELECT a FROM t")
+    cursor.fetchall()
+    with pytest.raises(pytest.fail.Exception):
+        cursor.execute("INSERT INTO t (a) VALUES (%s)", (5,))
+
+
+class _FakeCursor:
+    def __init__(self, connection: Any) -> None:
+        self.connection = connection
+        self._rows: List[Any] = []
+
+    def mogrify(self, query: str, args: Any = None) -> str:
+        return query
+
+    def execute(self, query: str, args: Any = None) -> int:
+        if query.startswith("SHOW COLUMNS"):
+            self._rows = [
+                ("a", "int", "NO", "PRI", None, ""),
+                ("b", "varchar(10)", "YES", "", None, ""),
+            ]
+        else:
+            self._rows = self.connection.results.get(query, [(1, "x"), (2, "y")])
+        return len(self._rows)
+
+    def fetchall(self) -> List[Any]:
+        return self._rows
+
+    def close(self) -> None:
+        pass
+
+
+class _FakeTableConnection:
+    def __init__(self, results: Optional[Dict[str, List[Any]]] = None) -> None:
+        self.results = results or {}
+
+    def cursor(self, cursor: Any = None) -> _FakeCursor:
+        return _FakeCursor(self)
+
+
+def test_recording_cursor_captures_tables_with_plain_connection(
+    request: FixtureRequest,
+) -> None:
+    """Test that tables are captured if the cursor's connection is not wrapped."""
+    database_mock = DatabaseMock(Mode.STORE_DATA, None, request, fallback=True)
+    cursor = _RecordingCursor(database_mock, _FakeCursor, _FakeTableConnection())
+    assert cursor.execute("SELECT a FROM t") == 2
+
+    assert database_mock._data["fallback--tables"] == [
+        _TableData(
+            name=("t",),
+            columns=[("a", "int"), ("b", "varchar(10)")],
+            rows=[(1, "x"), (2, "y")],
+            primary_key=(0,),
+        )
+    ]
+
+
+def test_recording_cursor_merges_touched_rows(request: FixtureRequest) -> None:
+    """Test that the rows touched by read queries are merged, up to the row limit."""
+    connection = _FakeTableConnection(
+        {
+            "SELECT DISTINCT s.* FROM t s WHERE a < 3 LIMIT 3": [(1, "x"), (2, "y")],
+            "SELECT DISTINCT `t`.* FROM t WHERE a > 1 LIMIT 1": [(2, "z")],
+        }
+    )
+    database_mock = DatabaseMock(
+        Mode.STORE_DATA,
+        None,
+        request,
+        fallback=True,
+        row_policy=_RowPolicy(max_rows=3),
+    )
+    cursor = _RecordingCursor(database_mock, _FakeCursor, connection)
+    cursor.execute("SELECT b FROM t s WHERE a < 3 ORDER BY b")
+    cursor.execute("SELECT b FROM t WHERE a > 1")
+
+    tables = database_mock._data["fallback--tables"]
+    assert len(tables) == 1
+    assert tables[0].rows == [(1, "x"), (2, "z")]
@@ -0,0 +1,109 @@
+import datetime
+from decimal import Decimal
+
+from pytest_pymysql_autorecord.fallback import (
+    _referenced_tables,
+    _SQLiteFallback,
+    _TableData,
+    _to_sqlite,
+    _touched_rows_query,
+)
+
+
+def test_referenced_tables() -> None:
+    """Test that the tables in FROM and JOIN clauses are found."""
+    query = (
+        "SELECT * FROM `user` u, shop.orders AS o "
+        "JOIN item ON item.id = o.item_id WHERE u.id IN (SELECT id FROM vip)"
+    )
+    assert _referenced_tables(query) == [
+        ("user",),
+        ("shop", "orders"),
+        ("item",),
+        ("vip",),
+    ]
+
+
+def test_touched_rows_query() -> None:
+    """Test that the touched rows are selected with the FROM and WHERE clauses."""
+    query = (
+        "SELECT u.name, COUNT(*) FROM `user` u JOIN orders o ON o.user_id = u.id "
+        "WHERE o.note = 'ORDER BY' GROUP BY u.name ORDER BY u.name LIMIT 5"
+    )
+    assert _touched_rows_query(query, ("user",), "u") == (
+        "SELECT DISTINCT u.* FROM `user` u JOIN orders o ON o.user_id = u.id "
+        "WHERE o.note = 'ORDER BY'"
+    )
+    assert _touched_rows_query(
+        "SELECT * FROM shop.item WHERE id IN (SELECT id FROM vip LIMIT 2)",
+        ("shop", "item"),
+        None,
+    ) == (
+        "SELECT DISTINCT `shop`.`item`.* FROM shop.item "
+        "WHERE id IN (SELECT id FROM vip LIMIT 2)"
+    )
+    assert (
+        _touched_rows_query("SELECT 1 FROM a UNION SELECT 2 FROM b", ("a",), None)
+        is None
+    )
+
+
+def test_to_sqlite() -> None:
+    """Test that MySQL quoting is translated into the SQLite dialect."""
+    assert (
+        _to_sqlite("SELECT `name` FROM t WHERE a='O\\'Brien' AND b=\"x\"")
+        == "SELECT \"name\" FROM t WHERE a='O''Brien' AND b='x'"
+    )
+
+
+def test_sqlite_fallback() -> None:
+    """Test that queries are answered from the captured tables."""
+    tables = [
+        _TableData(
+            name=("shop", "item"),
+            columns=[
+                ("id", "int(11)"),
+                ("name", "varchar(50)"),
+                ("price", "decimal(5,2)"),
+            ],
+            rows=[(1, "Apple", Decimal("1.50")), (2, "Pear", Decimal("2.00"))],
+        ),
+        _TableData(
+            name=("sale",),
+            columns=[("item_id", "int(11)"), ("day", "date")],
+            rows=[(2, datetime.date(2022, 5, 1))],
+        ),
+    ]
+    fallback = _SQLiteFallback(tables)
+    description, rows = fallback.execute(
+        "SELECT CONCAT(i.name, '!') AS label, s.day FROM shop.item i "
+        "JOIN `sale` s ON s.item_id = i.id"
+    )
+    assert [d[0] for d in description] == ["label", "day"]
+    assert rows == [("Pear!", datetime.date(2022, 5, 1))]
+
+    _, rows = fallback.execute("SELECT price FROM shop.item ORDER BY id")
+    assert rows == [(Decimal("1.50"),), (Decimal("2.00"),)]
+
+
+def test_sqlite_fallback_converts_time_values() -> None:
+    """Test that date and time values are returned as PyMySQL returns them."""
+    tables = [
+        _TableData(
+            name=("log",),
+            columns=[("logged_at", "datetime"), ("duration", "time")],
+            rows=[
+                (
+                    datetime.datetime(2022, 5, 1, 12, 30),
+                    datetime.timedelta(hours=-26, microseconds=500),
+                )
+            ],
+        )
+    ]
+    _, rows = _SQLiteFallback(tables).execute("SELECT logged_at, duration FROM log")
+    assert rows == [
+        (
+            datetime.datetime(2022, 5, 1, 12, 30),
+            datetime.timedelta(hours=-26, microseconds=500),
+        )
+    ]
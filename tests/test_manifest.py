@@ -0,0 +1,69 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from pytest_pymysql_autorecord.manifest import _Manifest
+from pytest_pymysql_autorecord.util import DatabaseMock, Mode
+
+
+def test_session_stops_for_corrupt_data_files(pytester: pytest.Pytester) -> None:
+    """Test that corrupt data files are detected before any test is run."""
+    pytester.makepyfile(test_example="""
+        def test_one(database_mock):
+            assert database_mock.user_value(1) == 1
+
+        def test_two(database_mock):
+            assert database_mock.user_value(2) == 2
+        """)
+    data_dir = pytester.path / "data"
+    pytester.runpytest("--store-db-data", "--db-data-dir", str(data_dir))
+    manifest = json.loads((data_dir / "manifest.json").read_text())
+    assert set(manifest["files"]) == {
+        "test_example/test_one.db",
+        "test_example/test_two.db",
+    }
+
+    result = pytester.runpytest("--mock-db-data", "--db-data-dir", str(data_dir))
+    result.assert_outcomes(passed=2)
+
+    with open(data_dir / "test_example" / "test_two.db", "ab") as f:
+        f.write(b"\0")
+    result = pytester.runpytest("--mock-db-data", "--db-data-dir", str(data_dir))
+    result.assert_outcomes()
+    result.stdout.fnmatch_lines(["*corrupt: test_example/test_two.db*"])
+
+
+def test_unknown_queries_fail_when_mocking(
+    request: pytest.FixtureRequest, tmp_path: Path
+) -> None:
+    """Test that queries which were not executed when storing fail the test."""
+    database_mock = DatabaseMock(Mode.STORE_DATA, tmp_path, request)
+    database_mock._queries.add("SELECT a FROM t WHERE a=%s")
+    database_mock._write_data()
+    manifest = _Manifest(tmp_path)
+    manifest.add(database_mock._filepath(), database_mock._queries)
+
+    database_mock = DatabaseMock(Mode.MOCK, tmp_path, request, manifest=manifest)
+    database_mock._check_query("SELECT a FROM t WHERE a=%s")
+    with pytest.raises(pytest.fail.Exception, match="was not executed"):
+        database_mock._check_query("SELECT b FROM t WHERE a=%s")
+
+
+def _add_data_files(data_dir: Path, worker: int) -> None:
+    for i in range(20):
+        filepath = data_dir / f"test_{worker}_{i}.db"
+        filepath.write_bytes(b"data")
+        manifest = _Manifest(data_dir)
+        manifest.add(filepath)
+        manifest.save()
+
+
+def test_concurrent_saves_preserve_entries(tmp_path: Path) -> None:
+    """Test that processes saving the manifest at the same time keep all entries."""
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(_add_data_files, [tmp_path] * 4, range(4)))
+
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    assert len(manifest["files"]) == 80
@@ -0,0 +1,136 @@
+import json
+from pathlib import Path
+from typing import Any, Dict, List
+
+from pytest import FixtureRequest
+
+from pytest_pymysql_autorecord import (
+    ChromeTraceListener,
+    OpenTelemetryTraceListener,
+    TraceEvent,
+    add_trace_listener,
+    remove_trace_listener,
+)
+from pytest_pymysql_autorecord.connect import _MockConnection
+from pytest_pymysql_autorecord.fallback import _TableData
+from pytest_pymysql_autorecord.util import DatabaseMock, Mode
+
+
+def _replay(request: FixtureRequest) -> None:
+    database_mock = DatabaseMock(Mode.STORE_DATA, None, request)
+    database_mock._record_value("cursor--execute", 2)
+    database_mock._record_rows("cursor--fetchall", ((1,), (2,)))
+    cursor = _MockConnection(database_mock).cursor()
+    cursor.execute("SELECT a FROM t")
+    cursor.fetchall()
+
+
+def test_trace_events_are_fired(request: FixtureRequest) -> None:
+    """Test that start and end events are fired for replayed calls."""
+    events: List[TraceEvent] = []
+    add_trace_listener(events.append)
+    try:
+        _replay(request)
+    finally:
+        remove_trace_listener(events.append)
+
+    assert [(e.phase, e.key) for e in events] == [
+        ("start", "cursor--execute"),
+        ("end", "cursor--execute"),
+        ("start", "cursor--fetchall"),
+        ("end", "cursor--fetchall"),
+    ]
+    assert events[1].sql == "SELECT a FROM t"
+    assert events[1].row_count == 2
+    assert events[1].bytes is None
+    assert events[3].row_count == 2
+    assert events[3].bytes is not None and events[3].bytes > 0
+    assert events[3].duration is not None and events[3].duration >= 0
+
+
+def test_trace_events_are_fired_for_fallback_queries(
+    request: FixtureRequest,
+) -> None:
+    """Test that events are fired for queries answered by the SQL fallback."""
+    database_mock = DatabaseMock(Mode.STORE_DATA, None, request, fallback=True)
+    database_mock._record_value(
+        "fallback--tables",
+        _TableData(name=("t",), columns=[("a", "int")], rows=[(1,), (2,), (3,)]),
+    )
+    cursor = _MockConnection(database_mock).cursor()
+    events: List[TraceEvent] = []
+    add_trace_listener(events.append)
+    try:
+        cursor.execute("SELECT a FROM t WHERE a > 1")
+        cursor.fetchall()
+    finally:
+        remove_trace_listener(events.append)
+
+    assert [(e.phase, e.key) for e in events] == [
+        ("start", "fallback--execute"),
+        ("end", "fallback--execute"),
+        ("start", "fallback--fetchall"),
+        ("end", "fallback--fetchall"),
+    ]
+    assert events[1].sql == "SELECT a FROM t WHERE a > 1"
+    assert events[1].row_count == 2
+    assert events[3].row_count == 2
+
+
+def test_chrome_trace_listener(request: FixtureRequest, tmp_path: Path) -> None:
+    """Test that the Chrome trace listener writes complete events."""
+    filepath = tmp_path / "trace.json"
+    listener = ChromeTraceListener(filepath)
+    add_trace_listener(listener)
+    try:
+        _replay(request)
+    finally:
+        remove_trace_listener(listener)
+    listener.write()
+
+    trace_events = json.loads(filepath.read_text())["traceEvents"]
+    assert [e["name"] for e in trace_events] == ["cursor--execute", "cursor--fetchall"]
+    assert all(e["ph"] == "X" for e in trace_events)
+    assert trace_events[0]["args"]["sql"] == "SELECT a FROM t"
+
+
+class _FakeSpan:
+    def __init__(self, name: str, attributes: Dict[str, Any]) -> None:
+        self.name = name
+        self.attributes = dict(attributes)
+        self.ended = False
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def end(self) -> None:
+        self.ended = True
+
+
+class _FakeTracer:
+    def __init__(self) -> None:
+        self.spans: List[_FakeSpan] = []
+
+    def start_span(self, name: str, attributes: Dict[str, Any]) -> _FakeSpan:
+        span = _FakeSpan(name, attributes)
+        self.spans.append(span)
+        return span
+
+
+def test_open_telemetry_trace_listener(request: FixtureRequest) -> None:
+    """Test that the OpenTelemetry listener creates a span for every call."""
+    tracer = _FakeTracer()
+    listener = OpenTelemetryTraceListener(tracer)
+    add_trace_listener(listener)
+    try:
+        _replay(request)
+    finally:
+        remove_trace_listener(listener)
+
+    assert [span.name for span in tracer.spans] == [
+        "cursor--execute",
+        "cursor--fetchall",
+    ]
+    assert all(span.ended for span in tracer.spans)
+    assert tracer.spans[0].attributes["db.statement"] == "SELECT a FROM t"
+    assert tracer.spans[1].attributes["db.row_count"] == 2
@@ -0,0 +1,179 @@
+import pytest
+from pytest import FixtureRequest
+
+from pytest_pymysql_autorecord.util import (
+    DatabaseMock,
+    Mode,
+    _CompactRows,
+    _PendingResult,
+    _RowPolicy,
+)
+
+
+def test_dict_rows_are_recorded_compactly(request: FixtureRequest) -> None:
+    """Test that dictionary rows are recorded as tuples with shared column names."""
+    database_mock = DatabaseMock(Mode.STORE_DATA, None, request)
+    rows = [{"id": 1, "name": "Alice"}, {"id": 2, "name": "Bob"}]
+    database_mock._record_rows("cursor--fetchall", rows)
+    database_mock._record_rows("cursor--fetchone", {"id": 3, "name": "Carol"})
+
+    recorded_all = database_mock._data["cursor--fetchall"][0]
+    recorded_one = database_mock._data["cursor--fetchone"][0]
+    assert isinstance(recorded_all, _CompactRows)
+    assert recorded_all.rows == [(1, "Alice"), (2, "Bob")]
+    assert recorded_all.columns is recorded_one.columns
+
+    assert database_mock._read_rows("cursor--fetchall") == rows
+    assert database_mock._read_rows("cursor--fetchone") == {"id": 3, "name": "Carol"}
+
+
+def test_fetchone_rows_are_recorded_together(request: FixtureRequest) -> None:
+    """Test that rows returned by consecutive fetchone calls are stored together."""
+    database_mock = DatabaseMock(Mode.STORE_DATA, None, request)
+    rows = [{"id": i, "name": f"user{i}"} for i in range(3)]
+    for row in rows:
+        database_mock._record_rows("cursor--fetchone", row)
+    database_mock._record_rows("cursor--fetchone", None)
+    database_mock._record_statement("SELECT id, name FROM users")
+    database_mock._record_rows("cursor--fetchone", rows[0])
+
+    assert len(database_mock._data["cursor--fetchone"]) == 3
+    for row in rows:
+        assert database_mock._read_rows("cursor--fetchone") == row
+    assert database_mock._read_rows("cursor--fetchone") is None
+    assert database_mock._read_counts["cursor--fetchone"] == 2
+    assert database_mock._read_rows("cursor--fetchone") == rows[0]
+
+
+def test_tuple_rows_are_recorded_unchanged(request: FixtureRequest) -> None:
+    """Test that rows which are not dictionaries are recorded as they are."""
+    database_mock = DatabaseMock(Mode.STORE_DATA, None, request)
+    database_mock._record_rows("cursor--fetchall", ((1, "Alice"),))
+    database_mock._record_rows("cursor--fetchone", None)
+
+    assert database_mock._read_rows("cursor--fetchall") == ((1, "Alice"),)
+    assert database_mock._read_rows("cursor--fetchone") is None
+
+
+def test_executemany_parameters_are_recorded_by_column(
+    request: FixtureRequest,
+) -> None:
+    """Test that executemany parameters are stored by column and verified."""
+    database_mock = DatabaseMock(Mode.STORE_DATA, None, request)
+    query = "INSERT INTO t (id, name) VALUES (%s, %s)"
+    args = [(1, "Alice"), (2, "Bob"), (3, "Carol")]
+    database_mock._record_batch("cursor--executemany", query, args, 3)
+    database_mock._record_batch("cursor--executemany", query, args, 3)
+
+    block = database_mock._data["cursor--executemany"][0]
+    assert block.columns == ((1, 2, 3), ("Alice", "Bob", "Carol"))
+    assert block.row_count == 3
+
+    assert database_mock._read_batch("cursor--executemany", query, args) == 3
+    with pytest.raises(pytest.fail.Exception):
+        database_mock._read_batch("cursor--executemany", query, args[:2])
+
+
+def test_executemany_digest_ignores_object_identity(request: FixtureRequest) -> None:
+    """Test that equal but distinct parameter objects have the same digest."""
+    database_mock = DatabaseMock(Mode.STORE_DATA, None, request)
+    query = "INSERT INTO t (name) VALUES (%s)"
+    database_mock._record_batch("cursor--executemany", query, [("abc",), ("abc",)], 2)
+
+    args = [("".join(["ab", "c"]),), ("".join(["a", "bc"]),)]
+    assert database_mock._read_batch("cursor--executemany", query, args) == 2
+
+
+@pytest.mark.parametrize(
+    "sample,expected",
+    [("head", [0, 1, 2]), ("tail", [7, 8, 9]), ("head_tail", [0, 1, 9])],
+)
+def test_row_policy_samples_rows(
+    request: FixtureRequest, sample: str, expected: list
+) -> None:
+    """Test that only the sampled rows of a query result are stored."""
+    database_mock = DatabaseMock(
+        Mode.STORE_DATA, None, request, row_policy=_RowPolicy(3, sample)
+    )
+    database_mock._record_rows("cursor--fetchall", tuple((i,) for i in range(10)))
+    database_mock._record_rows("cursor--fetchmany", [(0,), (1,)])
+
+    assert database_mock._read_rows("cursor--fetchall") == tuple((i,) for i in expected)
+    assert database_mock._read_rows("cursor--fetchmany") == [(0,), (1,)]
+    assert database_mock._data["meta--row-policy"] == [_RowPolicy(3, sample)]
+
+
+@pytest.mark.parametrize(
+    "sample,expected",
+    [
+        ("head", [[0, 1, 2], [3], [], []]),
+        ("tail", [[6, 7, 8], [9], [], []]),
+        ("head_tail", [[0, 1, 8], [9], [], []]),
+    ],
+)
+def test_row_policy_applies_to_result_sets(
+    request: FixtureRequest, sample: str, expected: list
+) -> None:
+    """Test that the row policy applies to all rows fetched for a result set."""
+    database_mock = DatabaseMock(
+        Mode.STORE_DATA, None, request, row_policy=_RowPolicy(4, sample)
+    )
+    result = _PendingResult()
+    for start in range(0, 10, 3):
+        rows = [(i,) for i in range(start, min(start + 3, 10))]
+        database_mock._record_rows("cursor--fetchmany", rows, result)
+    database_mock._record_rows("cursor--fetchone", (1, 2, 3, 4, 5), result)
+    database_mock._finish_rows(result)
+
+    for chunk in expected:
+        assert database_mock._read_rows("cursor--fetchmany") == [(i,) for i in chunk]
+    assert database_mock._read_rows("cursor--fetchone") == (1, 2, 3, 4, 5)
+
+
+def test_row_policy_adjusts_rowcounts(request: FixtureRequest) -> None:
+    """Test that the stored row counts match the sampled rows."""
+    database_mock = DatabaseMock(
+        Mode.STORE_DATA, None, request, row_policy=_RowPolicy(3)
+    )
+    result = _PendingResult()
+    database_mock._record_value("cursor--execute", 10)
+    database_mock._record_rowcount("cursor--execute", result)
+    database_mock._record_rows("cursor--fetchone", (0,), result)
+    database_mock._record_rows("cursor--fetchall", [(i,) for i in range(1, 10)], result)
+    database_mock._record_value("cursor--rowcount", 10)
+    database_mock._record_rowcount("cursor--rowcount", result)
+    database_mock._finish_rows(result)
+
+    assert database_mock._read_value("cursor--execute") == 4
+    assert database_mock._read_value("cursor--rowcount") == 4
+    assert database_mock._read_rows("cursor--fetchall") == [(1,), (2,), (3,)]
+
+
+def test_row_policy_is_only_evaluated_when_storing(pytester: pytest.Pytester) -> None:
+    """Test that an invalid db_data_rows marker is ignored unless data is stored."""
+    pytester.makepyfile(test_example="""
+        import pytest
+
+        @pytest.mark.db_data_rows(-1)
+        def test_rows(database_mock):
+            pass
+        """)
+    result = pytester.runpytest()
+    result.assert_outcomes(passed=1)
+
+
+@pytest.mark.parametrize("max_rows", ["-1", "'10'", "2.5"])
+def test_row_policy_rejects_invalid_max_rows(
+    pytester: pytest.Pytester, max_rows: str
+) -> None:
+    """Test that the db_data_rows marker requires a non-negative integer."""
+    pytester.makepyfile(test_example=f"""
+        import pytest
+
+        @pytest.mark.db_data_rows({max_rows})
+        def test_rows(database_mock):
+            pass
+        """)
+    result = pytester.runpytest("--store-db-data", "--db-data-dir", "data")
+    result.assert_outcomes(errors=1)
+    result.stdout.fnmatch_lines(["*must be a non-negative integer*"])